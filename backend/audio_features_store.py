@@ -0,0 +1,138 @@
+from fastapi.concurrency import run_in_threadpool
+from pathlib import Path
+import os
+import sqlite3
+import struct
+import threading
+
+# Audio features never change for a given track ID, so they are kept in a local
+# SQLite file shared by every worker on the host. Each row is one packed
+# float32 record in the field order below.
+AUDIO_FEATURES_DB_PATH = Path(
+    os.getenv("AUDIO_FEATURES_DB_PATH")
+    or Path(__file__).resolve().parent / ".cache" / "audio_features.sqlite3"
+)
+
+FEATURE_FIELDS = (
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+    "duration_ms",
+    "time_signature",
+)
+INT_FIELDS = {"key", "mode", "duration_ms", "time_signature"}
+_RECORD = struct.Struct(f"<{len(FEATURE_FIELDS)}f")
+_MISSING = float("nan")
+
+# SQLite caps bound parameters per statement; stay well under it.
+_QUERY_CHUNK = 500
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+_disabled = False
+
+
+def _connect() -> sqlite3.Connection | None:
+    global _conn, _disabled
+    if _conn is not None or _disabled:
+        return _conn
+    try:
+        AUDIO_FEATURES_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(AUDIO_FEATURES_DB_PATH, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS audio_features ("
+            "track_id TEXT PRIMARY KEY, record BLOB NOT NULL) WITHOUT ROWID"
+        )
+        _conn = conn
+    except Exception as e:
+        # A read-only or missing filesystem just means every lookup is a miss.
+        print(f"Audio features store unavailable: {e}")
+        _disabled = True
+    return _conn
+
+
+def _pack(feature: dict) -> bytes:
+    values = []
+    for field in FEATURE_FIELDS:
+        value = feature.get(field)
+        values.append(_MISSING if value is None else float(value))
+    return _RECORD.pack(*values)
+
+
+def _unpack(track_id: str, record: bytes) -> dict:
+    feature = {
+        "id": track_id,
+        "type": "audio_features",
+        "uri": f"spotify:track:{track_id}",
+        "track_href": f"https://api.spotify.com/v1/tracks/{track_id}",
+        "analysis_url": f"https://api.spotify.com/v1/audio-analysis/{track_id}",
+    }
+    for field, value in zip(FEATURE_FIELDS, _RECORD.unpack(record)):
+        if value != value:  # NaN marks a field Spotify did not send
+            feature[field] = None
+        elif field in INT_FIELDS:
+            feature[field] = int(round(value))
+        else:
+            # float32 keeps ~7 significant digits; trim the representation noise
+            feature[field] = float(f"{value:.6g}")
+    return feature
+
+
+def get_many(track_ids: list[str]) -> dict[str, dict]:
+    found: dict[str, dict] = {}
+    if not track_ids:
+        return found
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return found
+        for start in range(0, len(track_ids), _QUERY_CHUNK):
+            chunk = track_ids[start:start + _QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT track_id, record FROM audio_features WHERE track_id IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for track_id, record in rows:
+                found[track_id] = _unpack(track_id, record)
+    return found
+
+
+def put_many(features: list[dict]):
+    rows = [(f["id"], _pack(f)) for f in features if f and f.get("id")]
+    if not rows:
+        return
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO audio_features (track_id, record) VALUES (?, ?)",
+                rows,
+            )
+
+
+async def load(track_ids: list[str]) -> dict[str, dict]:
+    try:
+        return await run_in_threadpool(get_many, track_ids)
+    except Exception as e:
+        print(f"Failed to read audio features store: {e}")
+        return {}
+
+
+async def save(features: list[dict]):
+    try:
+        await run_in_threadpool(put_many, features)
+    except Exception as e:
+        print(f"Failed to write audio features store: {e}")
@@ -1,12 +1,44 @@
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Request
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
+import asyncio
+from backend import spotify_client
+from backend.redis_client import r
 from backend.routers import spotify, gemini
 
+# --- Lifespan ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Renew the Spotify app token ahead of expiry so requests never wait on it
+    token_refresher = asyncio.create_task(spotify.app_token_refresher())
+    # Write chat history behind the responses
+    history_writer = asyncio.create_task(gemini.chat_history_writer())
+    yield
+    await gemini.flush_chat_history()
+    for task in (token_refresher, history_writer):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    # Release pooled keep-alive connections to Spotify and Redis
+    await spotify_client.close()
+    await r.aclose(close_connection_pool=True)
+
 # --- App Initialization ---
-app = FastAPI(title="Spotify Playlist Generator")
+app = FastAPI(title="Spotify Playlist Generator", lifespan=lifespan)
+
+# --- Refreshed Token Cookies ---
+@app.middleware("http")
+async def attach_refreshed_token_cookies(request: Request, call_next):
+    # Any code path that refreshed the user's token during this request leaves it
+    # on request.state; make sure the browser gets the new cookies.
+    response = await call_next(request)
+    token_data = getattr(request.state, "refreshed_token", None)
+    if token_data:
+        spotify.set_refreshed_token_cookies(response, token_data)
+    return response
 
 # --- API Router ---
 api_router = APIRouter(prefix="/api")
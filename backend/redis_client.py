@@ -0,0 +1,22 @@
+import redis.asyncio as redis
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# One bounded pool per process. Callers wait up to REDIS_POOL_TIMEOUT for a free
+# connection instead of failing, and a stalled server cannot hang a request.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+
+pool = redis.BlockingConnectionPool.from_url(
+    os.environ.get("REDIS_URL_UPSTASH"),
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+    health_check_interval=30,
+)
+r: redis.Redis = redis.Redis(connection_pool=pool)
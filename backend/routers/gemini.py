@@ -1,44 +1,37 @@
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from google import genai
 from google.genai import types
 import os
 from dotenv import load_dotenv
 from backend.routers.gemini_models import ChatRequest, ChatHistoryItem, CreateSessionRequest, SessionResponse, MessageResponse, SessionMessagesResponse
 from backend.supabase import supabase
-from datetime import datetime
+from backend.redis_client import r
+from backend import spotify_client, track_index, session_store
+from datetime import datetime, timezone
 from backend.routers.gemini_tools import *
 from backend.routers.spotify import (
     create_playlist,
     search_spotify_songs,
     add_tracks_to_playlist,
     get_current_user_id,
-    get_user_playlists_context,
-    get_user_top_tastes_context,
+    get_user_ai_context,
     get_user_top_artists_data,
     get_user_top_tracks_data,
     get_user_top_genres_data,
     get_user_taste_profile_data,
+    _get_spotify_user_access_token,
 )
-import redis
+import asyncio
+import base64
+import hashlib
 import json
 
 load_dotenv()
 router = APIRouter()
-redis_url = os.environ.get("REDIS_URL_UPSTASH")
-r = redis.Redis.from_url(redis_url)
-
-def get_session(user_id):  
-    data = r.get(user_id)
-    if data:
-        return json.loads(data)
-    return {
-        "awaiting_confirmation": False,
-        "pending_playlist": None,
-        "logged_in": True,
-    }
 
-def save_session(user_id, session):
-    r.set(user_id, json.dumps(session), ex=3600)  # expires in 1 hour
 # Initialize Gemini Client
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -52,6 +45,36 @@ except Exception as e:
     client = None
 
 GEMINI_MODEL = "gemini-2.5-flash"
+# Keyset pagination for sessions and messages: explicit columns, newest page by default
+MESSAGE_PAGE_SIZE = 50
+SESSION_PAGE_SIZE = 50
+MESSAGE_COLUMNS = "id, role, content, created_at"
+SESSION_COLUMNS = "id, user_id, title, created_at, updated_at"
+# Chat history is written behind the response: turns are queued and persisted in
+# order by one background worker (started from the app lifespan), with retries.
+CHAT_HISTORY_RETRIES = int(os.getenv("CHAT_HISTORY_RETRIES", "5"))
+_chat_history_queue: asyncio.Queue = asyncio.Queue()
+# History sent to Gemini: the last CHAT_HISTORY_KEEP_TURNS turns verbatim, within
+# CHAT_HISTORY_TOKEN_BUDGET (estimated) tokens together with the rolling summary.
+# Older turns are folded into the summary in the background once
+# CHAT_HISTORY_FOLD_TURNS of them have built up.
+CHAT_HISTORY_KEEP_TURNS = int(os.getenv("CHAT_HISTORY_KEEP_TURNS", "6"))
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "6000"))
+CHAT_HISTORY_FOLD_TURNS = int(os.getenv("CHAT_HISTORY_FOLD_TURNS", "4"))
+_folding_sessions: set[str] = set()
+# Streamed turns run to completion even if the client goes away
+_stream_tasks: set[asyncio.Task] = set()
+_fold_tasks: set[asyncio.Task] = set()
+# The chat system instruction and tool declarations are stored as Gemini cached
+# content, keyed by a hash of their text and owner, so a turn only sends the new
+# messages. Each owner keeps one current cache; the one it replaces is deleted.
+# Instructions below the minimum cacheable size are sent inline.
+GEMINI_CACHE_TTL = int(os.getenv("GEMINI_CACHE_TTL", "3600"))
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CACHE_MIN_TOKENS", "1024"))
+_context_caches: dict[str, tuple[str, float]] = {}
+_context_cache_creates: dict[str, asyncio.Future] = {}
+# Spotify searches run at once while resolving a proposal's track queries
+PROPOSAL_SEARCH_CONCURRENCY = int(os.getenv("PROPOSAL_SEARCH_CONCURRENCY", "10"))
 
 
 def _clamp_int(value, default: int, minimum: int, maximum: int) -> int:
@@ -69,7 +92,67 @@ def _normalize_time_range(value) -> str:
     return "medium_term"
 
 
-def _generate_taste_analysis_response(
+async def _resolve_track_query(query: str) -> tuple[str | None, dict]:
+    """Resolve one proposal query to (track_id, display entry). track_id is None when nothing matched.
+
+    The local track index is consulted first; Spotify search results are added to it.
+    """
+    match = await track_index.lookup(query)
+    if match:
+        return match["id"], match["display"]
+
+    try:
+        result = await search_spotify_songs(
+            query=query,
+            type="track",
+            limit=1,
+        )
+    except Exception:
+        return None, {"name": query, "artists": "(search failed)", "url": "", "image": ""}
+
+    items = (result.get("tracks") or {}).get("items") or []
+    if not items:
+        return None, {"name": query, "artists": "(not found)", "url": "", "image": ""}
+
+    t = items[0]
+    artist_names = [a["name"] for a in t.get("artists") or []]
+    images = t.get("album", {}).get("images", [])
+    cover_image = images[0].get("url") if images else ""
+    display = {
+        "name": t.get("name", query),
+        "artists": ", ".join(artist_names),
+        "url": t.get("external_urls", {}).get("spotify", ""),
+        "image": cover_image
+    }
+    await track_index.remember(t["id"], t.get("name") or "", artist_names, display)
+    return t["id"], display
+
+
+def _ignore_event(event: str, data: dict):
+    pass
+
+
+async def _resolve_track_queries(queries: list[str], emit=_ignore_event) -> list[tuple[str | None, dict]]:
+    """Resolve proposal queries concurrently. Results keep the order of `queries`.
+
+    Emits a progress event as each query resolves.
+    """
+    resolved = 0
+
+    async def resolve(query: str):
+        nonlocal resolved
+        result = await _resolve_track_query(query)
+        resolved += 1
+        emit("progress", {"stage": "resolving_tracks", "resolved": resolved, "total": len(queries)})
+        return result
+
+    return await spotify_client.gather_limited(
+        *(resolve(query) for query in queries),
+        limit=PROPOSAL_SEARCH_CONCURRENCY,
+    )
+
+
+async def _generate_taste_analysis_response(
     *,
     user_message: str,
     history: list[types.Content],
@@ -91,7 +174,7 @@ def _generate_taste_analysis_response(
     )
 
     try:
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=GEMINI_MODEL,
             config=types.GenerateContentConfig(
                 system_instruction=analysis_instruction,
@@ -109,6 +192,386 @@ def _generate_taste_analysis_response(
         print(f"Failed to generate taste analysis response: {e}")
         return "I could fetch your listening taste data, but I couldn't turn it into a useful answer right now."
 
+def _insert_chat_messages(turn: dict):
+    # Both messages in one insert; explicit timestamps keep turns ordered even when retried
+    supabase.table("chat_messages").insert([
+        {
+            "session_id": turn["session_id"],
+            "role": "user",
+            "content": turn["user_message"],
+            "created_at": turn["user_at"],
+        },
+        {
+            "session_id": turn["session_id"],
+            "role": "model",
+            "content": turn["model_message"],
+            "created_at": turn["model_at"],
+        },
+    ]).execute()
+
+
+def _touch_chat_session(turn: dict):
+    supabase.table("chat_sessions").update({
+        "updated_at": turn["model_at"]
+    }).eq("id", turn["session_id"]).execute()
+
+
+async def _persist_chat_turn(turn: dict):
+    for attempt in range(1, CHAT_HISTORY_RETRIES + 1):
+        try:
+            # supabase-py is synchronous, so keep its round trips off the event loop
+            if not turn.get("inserted"):
+                await run_in_threadpool(_insert_chat_messages, turn)
+                turn["inserted"] = True
+            await run_in_threadpool(_touch_chat_session, turn)
+            return
+        except Exception as e:
+            print(f"Failed to save chat history (attempt {attempt}): {e}")
+            if attempt < CHAT_HISTORY_RETRIES:
+                await asyncio.sleep(min(2 ** attempt, 30))
+    print(f"Dropping chat turn for session {turn['session_id']} after {CHAT_HISTORY_RETRIES} attempts")
+
+
+def enqueue_chat_turn(session_id: str, user_message: str, model_message: str, user_at: datetime):
+    _chat_history_queue.put_nowait({
+        "session_id": session_id,
+        "user_message": user_message,
+        "model_message": model_message,
+        "user_at": user_at.isoformat(),
+        "model_at": datetime.now(timezone.utc).isoformat(),
+    })
+
+
+async def chat_history_writer():
+    """Persist queued chat turns one at a time, in order."""
+    while True:
+        turn = await _chat_history_queue.get()
+        try:
+            await _persist_chat_turn(turn)
+        finally:
+            _chat_history_queue.task_done()
+
+
+async def flush_chat_history(timeout: float = 10):
+    """Wait for queued turns to be written (used on shutdown)."""
+    try:
+        await asyncio.wait_for(_chat_history_queue.join(), timeout)
+    except asyncio.TimeoutError:
+        print(f"Shutting down with {_chat_history_queue.qsize()} chat turns unsaved")
+
+def _encode_cursor(timestamp: str, row_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, row_id]).encode()).decode()
+
+
+def _keyset_filter(column: str, op: str, cursor: str) -> str:
+    """PostgREST `or` filter for rows strictly before ("lt") or after ("gt") the cursor's (column, id)."""
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return f'{column}.{op}."{timestamp}",and({column}.eq."{timestamp}",id.{op}."{row_id}")'
+
+
+def _query_messages(session_id: str, limit: int, before: str | None, after: str | None) -> tuple[list[dict], bool]:
+    """One page of messages, oldest first, and whether more exist in the paging direction."""
+    query = supabase.table("chat_messages").select(MESSAGE_COLUMNS).eq("session_id", session_id)
+    if after:
+        query = query.or_(_keyset_filter("created_at", "gt", after)).order("created_at").order("id")
+    else:
+        if before:
+            query = query.or_(_keyset_filter("created_at", "lt", before))
+        query = query.order("created_at", desc=True).order("id", desc=True)
+    rows = query.limit(limit + 1).execute().data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not after:
+        rows.reverse()
+    return rows, has_more
+
+
+async def _load_stored_history(session_id: str, user_id: str) -> list[dict]:
+    """Latest messages of a session from Supabase, as session_store history entries."""
+    session_res, (rows, _) = await asyncio.gather(
+        run_in_threadpool(
+            supabase.table("chat_sessions").select("user_id").eq("id", session_id).execute
+        ),
+        run_in_threadpool(_query_messages, session_id, session_store.SESSION_HISTORY_MAX, None, None),
+    )
+    if not session_res.data or session_res.data[0]["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this session")
+    return [{"role": row["role"], "text": row["content"]} for row in rows]
+
+
+def _estimate_tokens(text: str) -> int:
+    # Roughly four characters per token; close enough for budgeting without a count_tokens call
+    return len(text) // 4 + 1
+
+
+def _window_history(messages: list[dict], summary: str = "") -> list[dict]:
+    """The most recent messages that fit the turn and token budget, oldest first."""
+    budget = CHAT_HISTORY_TOKEN_BUDGET - _estimate_tokens(summary)
+    window = []
+    for message in reversed(messages[-2 * CHAT_HISTORY_KEEP_TURNS:]):
+        cost = _estimate_tokens(message["text"])
+        if cost > budget:
+            break
+        budget -= cost
+        window.append(message)
+    window.reverse()
+    # Gemini expects the history to open with a user message
+    while window and window[0]["role"] != "user":
+        window.pop(0)
+    return window
+
+
+async def _summarize_history(summary: str, messages: list[dict]) -> str:
+    transcript = "\n".join(f"{message['role']}: {message['text']}" for message in messages)
+    response = await client.aio.models.generate_content(
+        model=GEMINI_MODEL,
+        config=types.GenerateContentConfig(
+            system_instruction=(
+                "You maintain a running summary of a conversation between a user and a Spotify AI DJ.\n"
+                "Merge the new messages into the existing summary. Keep the user's stated moods, genres, "
+                "artists, likes and dislikes, and any playlists proposed or created. Drop small talk.\n"
+                "Answer with the updated summary only, in at most 200 words."
+            ),
+        ),
+        contents=f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}",
+    )
+    return (response.text or "").strip()
+
+
+async def _fold_history(session_id: str, folded: list[dict], summary: str):
+    try:
+        new_summary = await _summarize_history(summary, folded)
+        if new_summary:
+            await session_store.fold_history(session_id, folded, summary, new_summary)
+    except Exception as e:
+        print(f"Failed to summarize chat history: {e}")
+    finally:
+        _folding_sessions.discard(session_id)
+
+
+def _schedule_fold(session_state: dict):
+    """Fold turns older than the kept window into the summary, off the request path."""
+    session_id = session_state["session_id"]
+    history = session_state["history"]
+    keep = 2 * CHAT_HISTORY_KEEP_TURNS
+    over_budget = sum(_estimate_tokens(message["text"]) for message in history) > CHAT_HISTORY_TOKEN_BUDGET
+    if session_id in _folding_sessions or len(history) <= keep:
+        return
+    if len(history) < keep + 2 * CHAT_HISTORY_FOLD_TURNS and not over_budget:
+        return
+    _folding_sessions.add(session_id)
+    task = asyncio.create_task(_fold_history(session_id, history[:-keep], session_state["summary"]))
+    _fold_tasks.add(task)
+    task.add_done_callback(_fold_tasks.discard)
+
+
+CHAT_TOOLS = [
+    {
+        "function_declarations": [
+            propose_playlist,
+            confirm_and_create_playlist,
+            delete_proposed_playlist,
+            add_tracks_to_proposal,
+            remove_tracks_from_proposal,
+            get_user_top_artists,
+            get_user_top_tracks,
+            get_user_top_genres,
+            get_user_taste_profile,
+        ]
+    }
+]
+
+
+def _context_cache_key(owner: str | None, system_instruction: str) -> str:
+    return "gemini_cache:" + hashlib.sha256(f"{GEMINI_MODEL}\n{owner or ''}\n{system_instruction}".encode()).hexdigest()
+
+
+def _context_owner_key(owner: str) -> str:
+    return f"gemini_cache_owner:{owner}"
+
+
+async def _delete_context_cache(key: str, name: str):
+    _context_caches.pop(key, None)
+    try:
+        await r.delete(key)
+        await client.aio.caches.delete(name=name)
+    except Exception as e:
+        print(f"Failed to delete Gemini context cache {name}: {e}")
+
+
+async def _create_context_cache(key: str, system_instruction: str, owner: str | None) -> tuple[str, float] | None:
+    """(name, expires_at) of the cache for `key`, creating it if no worker has yet."""
+    try:
+        raw = await r.get(key)
+        if raw:
+            entry = json.loads(raw)
+            return entry["name"], entry["expires_at"]
+    except Exception as e:
+        print(f"Failed to read Gemini cache pointer: {e}")
+
+    try:
+        cache = await client.aio.caches.create(
+            model=GEMINI_MODEL,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                tools=CHAT_TOOLS,
+                ttl=f"{GEMINI_CACHE_TTL}s",
+            ),
+        )
+    except Exception as e:
+        print(f"Failed to create Gemini context cache: {e}")
+        return None
+
+    now = datetime.now().timestamp()
+    expires_at = cache.expire_time.timestamp() if cache.expire_time else now + GEMINI_CACHE_TTL
+    entry = json.dumps({"name": cache.name, "expires_at": expires_at})
+    try:
+        # Expire the pointer a little before the cache itself
+        await r.set(key, entry, ex=max(int(expires_at - now) - 60, 1))
+        if owner:
+            # The owner's previous cache is superseded; delete it instead of paying for it until its TTL
+            previous = await r.set(_context_owner_key(owner), json.dumps({"key": key, "name": cache.name}), ex=GEMINI_CACHE_TTL, get=True)
+            if previous:
+                previous = json.loads(previous)
+                if previous["name"] != cache.name:
+                    await _delete_context_cache(previous["key"], previous["name"])
+    except Exception as e:
+        print(f"Failed to write Gemini cache pointer: {e}")
+    return cache.name, expires_at
+
+
+async def _cached_context(system_instruction: str, owner: str | None) -> str | None:
+    """Name of a cached content entry holding `system_instruction` and the chat tools, or None to send them inline.
+
+    `owner` (the Spotify user, else the session) scopes the cache, so replacing it
+    when that owner's context changes never pulls a cache from under someone else.
+    """
+    if _estimate_tokens(system_instruction) < GEMINI_CACHE_MIN_TOKENS:
+        return None
+    key = _context_cache_key(owner, system_instruction)
+    now = datetime.now().timestamp()
+    cached = _context_caches.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    # Concurrent turns with the same context share one create
+    future = _context_cache_creates.get(key)
+    if future is None:
+        future = asyncio.ensure_future(_create_context_cache(key, system_instruction, owner))
+        _context_cache_creates[key] = future
+        future.add_done_callback(lambda _: _context_cache_creates.pop(key, None))
+    created = await asyncio.shield(future)
+    if not created:
+        return None
+    name, expires_at = created
+    if expires_at - 60 <= now:
+        return None
+    _context_caches[key] = (name, expires_at - 60)
+    return name
+
+
+async def _forget_context_cache(system_instruction: str, owner: str | None):
+    key = _context_cache_key(owner, system_instruction)
+    _context_caches.pop(key, None)
+    try:
+        await r.delete(key)
+    except Exception as e:
+        print(f"Failed to delete Gemini cache pointer: {e}")
+
+
+def _response_parts(response) -> tuple[types.FunctionCall | None, str]:
+    """The first function call and the concatenated text of a response or stream chunk."""
+    candidate = response.candidates[0] if response.candidates else None
+    parts = candidate.content.parts if candidate and candidate.content and candidate.content.parts else []
+    function_call = next((part.function_call for part in parts if part.function_call), None)
+    return function_call, "".join(part.text for part in parts if part.text)
+
+
+async def _chat_once(config: types.GenerateContentConfig, history: list[types.Content], message: str, on_text):
+    chat = client.aio.chats.create(model=GEMINI_MODEL, config=config, history=history)
+    if on_text is None:
+        return _response_parts(await chat.send_message(message))
+
+    function_call, texts = None, []
+    async for chunk in await chat.send_message_stream(message):
+        chunk_call, text = _response_parts(chunk)
+        function_call = function_call or chunk_call
+        if text:
+            texts.append(text)
+            on_text(text)
+    return function_call, "".join(texts)
+
+
+async def _send_chat_message(
+    system_instruction: str,
+    history: list[types.Content],
+    message: str,
+    on_text=None,
+    cache_owner: str | None = None,
+):
+    """Send one chat turn, using the cached instruction and tools when available.
+
+    Returns (function_call, text). With `on_text`, the reply is streamed and each
+    text chunk is passed to it as it arrives.
+    """
+    cache_name = await _cached_context(system_instruction, cache_owner)
+    if cache_name:
+        streamed = False
+
+        def on_cached_text(text: str):
+            nonlocal streamed
+            streamed = True
+            on_text(text)
+
+        try:
+            return await _chat_once(
+                types.GenerateContentConfig(cached_content=cache_name),
+                history,
+                message,
+                on_cached_text if on_text else None,
+            )
+        except Exception as e:
+            if streamed:
+                raise
+            # The cache may have expired or been deleted early; send everything inline instead
+            print(f"Cached Gemini call failed, retrying without cache: {e}")
+            await _forget_context_cache(system_instruction, cache_owner)
+
+    return await _chat_once(
+        types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            tools=CHAT_TOOLS,
+        ),
+        history,
+        message,
+        on_text,
+    )
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def _summary_contents(summary: str) -> list[types.Content]:
+    # Kept out of the system instruction so the cached context does not change with every fold
+    if not summary:
+        return []
+    return [
+        types.Content(role="user", parts=[types.Part.from_text(text=f"Summary of our earlier conversation:\n{summary}")]),
+        types.Content(role="model", parts=[types.Part.from_text(text="Got it, I'll keep that in mind.")]),
+    ]
+
+
+def _history_contents(messages: list[dict]) -> list[types.Content]:
+    return [
+        types.Content(role=message["role"], parts=[types.Part.from_text(text=message["text"])])
+        for message in messages
+    ]
+
+
 def check_api_key():
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="GEMINI_API_KEY not found in environment variables. Please add it to backend/.env")
@@ -130,29 +593,60 @@ def create_session(body: CreateSessionRequest, user_id: str = Depends(get_curren
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions", response_model=list[SessionResponse])
-def get_sessions(user_id: str = Depends(get_current_user_id)):
+def get_sessions(
+    response: Response,
+    limit: int = Query(SESSION_PAGE_SIZE, ge=1, le=200),
+    before: str | None = None,
+    user_id: str = Depends(get_current_user_id),
+):
+    """Most recently updated sessions first. When more exist, X-Next-Cursor holds the `before` value for the next page."""
     try:
-        response = supabase.table("chat_sessions").select("*").eq("user_id", user_id).order("updated_at", desc=True).execute()
-        return response.data
+        query = supabase.table("chat_sessions").select(SESSION_COLUMNS).eq("user_id", user_id)
+        if before:
+            query = query.or_(_keyset_filter("updated_at", "lt", before))
+        rows = query.order("updated_at", desc=True).order("id", desc=True).limit(limit + 1).execute().data or []
+        if len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+        return rows
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/sessions/{session_id}/messages", response_model=SessionMessagesResponse)
-def get_session_messages(session_id: str, user_id: str = Depends(get_current_user_id)):
+async def get_session_messages(
+    session_id: str,
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=200),
+    before: str | None = None,
+    after: str | None = None,
+    user_id: str = Depends(get_current_user_id),
+):
+    """The latest `limit` messages, or the page before/after a cursor, oldest first.
+
+    `has_more` says whether more messages exist in the paging direction;
+    `older_cursor`/`newer_cursor` are the `before`/`after` values for the neighbouring pages.
+    """
     try:
-        # First, ensure the session actually belongs to this user
-        session_res = supabase.table("chat_sessions").select("user_id").eq("id", session_id).execute()
+        # The ownership check, the page and the Redis state are independent; fetch them together
+        session_res, (rows, has_more), session_state = await asyncio.gather(
+            run_in_threadpool(
+                supabase.table("chat_sessions").select("user_id").eq("id", session_id).execute
+            ),
+            run_in_threadpool(_query_messages, session_id, limit, before, after),
+            session_store.load(session_id),
+        )
+        # Ensure the session actually belongs to this user
         if not session_res.data or session_res.data[0]["user_id"] != user_id:
             raise HTTPException(status_code=403, detail="Not authorized to access this session")
-
-        response = supabase.table("chat_messages").select("*").eq("session_id", session_id).order("created_at", desc=False).execute()
-        
-        session_state = get_session(session_id)
         
         return SessionMessagesResponse(
-            messages=response.data,
+            messages=rows,
             is_awaiting_confirmation=session_state.get("awaiting_confirmation", False),
-            pending_playlist=session_state.get("pending_playlist")
+            pending_playlist=session_state.get("pending_playlist"),
+            has_more=has_more,
+            older_cursor=_encode_cursor(rows[0]["created_at"], rows[0]["id"]) if rows else None,
+            newer_cursor=_encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if rows else None,
         )
     except HTTPException:
         raise
@@ -185,6 +679,55 @@ def delete_session(session_id: str, user_id: str = Depends(get_current_user_id))
 @router.post("/chat")
 async def chat_endpoint(req: Request, request: ChatRequest):
     check_api_key()
+    return await _run_chat_turn(req, request)
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(req: Request, request: ChatRequest):
+    """The chat turn as Server-Sent Events.
+
+    `text` events carry reply chunks as Gemini produces them, `progress` events
+    report tool work (e.g. resolving proposal tracks), and a final `done` event
+    carries the same payload /chat returns (its `text` replaces the streamed
+    chunks when a tool ran). Failures end the stream with an `error` event.
+    """
+    check_api_key()
+    # Headers go out before the turn runs, so refresh the token now for the cookie middleware
+    await _get_spotify_user_access_token(req)
+
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run_turn():
+        try:
+            return await _run_chat_turn(req, request, emit=lambda event, data: events.put_nowait((event, data)))
+        finally:
+            events.put_nowait(None)
+
+    task = asyncio.create_task(run_turn())
+    _stream_tasks.add(task)
+    task.add_done_callback(_stream_tasks.discard)
+    # Mark errors as retrieved even if the client disconnected before the last event
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def event_stream():
+        while (item := await events.get()) is not None:
+            yield _sse(*item)
+        try:
+            yield _sse("done", await task)
+        except HTTPException as he:
+            yield _sse("error", {"detail": he.detail})
+        except Exception as e:
+            yield _sse("error", {"detail": f"Chat error: {e}"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _run_chat_turn(req: Request, request: ChatRequest, emit=_ignore_event):
+    """One chat turn. `emit(event, data)` receives streamed text and progress events."""
     try:
         # 1. Create session if provided session_id doesn't exist or is None? 
         # Actually, if session_id is None, we should probably create one or just treat as ephemeral.
@@ -193,17 +736,22 @@ async def chat_endpoint(req: Request, request: ChatRequest):
         # Better: If session_id is provided, save.
         
         session_id = request.session_id #chat session 
+        turn_started_at = datetime.now(timezone.utc)
         
         # Only get session state from Redis if we have a valid session_id
+        user_id = None
         if session_id:
-            session_state = get_session(session_id)
+            user_id, session_state = await asyncio.gather(
+                get_current_user_id(req),
+                session_store.load(session_id),
+            )
+            # The Redis copy records who owns the session. When it is missing, expired or
+            # names someone else, Supabase decides (403 for other users) and the copy is rebuilt.
+            if not session_state["history_cached"] or session_state["owner"] != user_id:
+                session_store.seed_history(session_state, await _load_stored_history(session_id, user_id), user_id)
         else:
             # Default session state non-logged in or no session provided
-            session_state = {
-                "awaiting_confirmation": False,
-                "pending_playlist": None,
-                "logged_in": False,
-            }
+            session_state = session_store.new_state(logged_in=False)
 
         # Handle pending playlist override from frontend
         if request.pending_playlist_override and session_state.get("pending_playlist"):
@@ -211,20 +759,28 @@ async def chat_endpoint(req: Request, request: ChatRequest):
             print("OVERRIDE RECEIVED FOR:", request.pending_playlist_override.get('name'))
             print("TRACK IDS COUNT OVERRIDE:", len(request.pending_playlist_override.get('track_ids', [])))
             
-            session_state["pending_playlist"] = request.pending_playlist_override
-            if session_id:
-                save_session(session_id, session_state)
-
-        # Optimize history for Gemini
-        formatted_history = []
-        for item in request.history:
-            formatted_history.append(types.Content(
-                role=item.role,
-                parts=[types.Part.from_text(text=part) for part in item.parts]
-            ))
-
-        playlist_context = get_user_playlists_context(req)
-        tastes_context = get_user_top_tastes_context(req)
+            override = request.pending_playlist_override
+            name = override.get("name") or session_state["pending_playlist"].get("name")
+            items = session_store.items_from_proposal(override)
+            # The page sends the proposal back every turn; only rewrite it if the user edited it
+            if not session_store.proposal_matches(session_state, name, override.get("description"), items):
+                session_store.replace_proposal(
+                    session_state, name, override.get("description"), items,
+                    playlist_id=session_state["pending_playlist"].get("playlist_id"),
+                )
+
+        # Sessions keep their history server-side; only session-less chats send it along
+        if session_id:
+            history_messages = session_state["history"]
+            history_summary = session_state["summary"]
+        else:
+            history_messages = [{"role": item.role, "text": "\n".join(item.parts)} for item in request.history]
+            history_summary = ""
+        formatted_history = _summary_contents(history_summary) + _history_contents(
+            _window_history(history_messages, history_summary)
+        )
+
+        playlist_context, tastes_context = await get_user_ai_context(req)
         system_instruction_text = (
             "You are a Spotify AI DJ. Your goal is to help users build playlists based on their feelings, moods, or described scenarios.\n\n"
             f"{playlist_context}\n{tastes_context}\n\n"
@@ -243,39 +799,27 @@ async def chat_endpoint(req: Request, request: ChatRequest):
             "   <Playlist Name> - [View Playlist](/playlists/<playlist_id>)"
         )
 
-        chat = client.chats.create(
-            model=GEMINI_MODEL,
-            config=types.GenerateContentConfig(
-                system_instruction=system_instruction_text,
-                tools=[
-                    {
-                        "function_declarations": [
-                            propose_playlist,
-                            confirm_and_create_playlist,
-                            delete_proposed_playlist,
-                            add_tracks_to_proposal,
-                            remove_tracks_from_proposal,
-                            get_user_top_artists,
-                            get_user_top_tracks,
-                            get_user_top_genres,
-                            get_user_taste_profile,
-                        ]
-                    }
-                ],
-            ),
-            history=formatted_history
+        cache_owner = user_id
+        if not cache_owner:
+            try:
+                cache_owner = await get_current_user_id(req)
+            except Exception:
+                cache_owner = None
+        function_call, response_text = await _send_chat_message(
+            system_instruction_text,
+            formatted_history,
+            request.message,
+            on_text=(lambda text: emit("text", {"delta": text})) if emit is not _ignore_event else None,
+            cache_owner=cache_owner,
         )
-        
-        response = chat.send_message(request.message)
 
         # Check for function call
-        candidate = response.candidates[0] if response.candidates else None
-        
-        if candidate and candidate.content and candidate.content.parts and candidate.content.parts[0].function_call:
-            function_call = candidate.content.parts[0].function_call
+        if function_call:
             function_name = function_call.name
             print("func name", function_name)
             args = dict(function_call.args)
+            if function_name.startswith("getUser"):
+                emit("progress", {"stage": "analyzing_taste"})
 
             # -------------------------
             # PHASE 1: Proposal Phase
@@ -283,48 +827,19 @@ async def chat_endpoint(req: Request, request: ChatRequest):
             
             if function_name == "proposePlaylist":
                 # Search Spotify for each track first; cache track IDs in Redis
-                track_ids = []
-                tracks_display = []
-                for query in args.get("tracks") or []:
-                    try:
-                        result = search_spotify_songs(
-                            query=query,
-                            type="track",
-                            limit=1,
-                        )
-                        items = (result.get("tracks") or {}).get("items") or []
-                        if items:
-                            t = items[0]
-                            track_ids.append(t["id"])
-                            artists = ", ".join(a["name"] for a in t.get("artists") or [])
-                            
-                            images = t.get("album", {}).get("images", [])
-                            cover_image = images[0].get("url") if images else ""
-                            
-                            tracks_display.append({
-                                "name": t.get("name", query), 
-                                "artists": artists, 
-                                "url": t.get("external_urls", {}).get("spotify", ""),
-                                "image": cover_image
-                            })
-                        else:
-                            tracks_display.append({"name": query, "artists": "(not found)", "url": "", "image": ""})
-                    except Exception:
-                        tracks_display.append({"name": query, "artists": "(search failed)", "url": "", "image": ""})
+                resolved = await _resolve_track_queries(args.get("tracks") or [], emit)
 
                 base_desc = args.get("description") or ""
                 current_date = datetime.now().strftime("%m/%d/%Y")
                 desc_with_date = f"{base_desc} (Generated on {current_date})" if base_desc else f"Generated on {current_date}"
 
-                session_state["pending_playlist"] = {
-                    "name": args.get("name", "New Playlist"),
-                    "description": desc_with_date,
-                    "track_ids": track_ids,
-                    "tracks_display": tracks_display,
-                }
                 session_state["awaiting_confirmation"] = True
-                if session_id:
-                    save_session(session_id, session_state)
+                session_store.replace_proposal(
+                    session_state,
+                    args.get("name", "New Playlist"),
+                    desc_with_date,
+                    resolved,
+                )
 
                 user_text = "I've drafted a playlist for you! Click **Review** below to see the tracks and confirm."
 
@@ -335,40 +850,11 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not session_state.get("pending_playlist"):
                     user_text = "There is no pending playlist to add tracks to. Please ask me to propose one first."
                 else:
-                    track_ids = session_state["pending_playlist"].get("track_ids", [])
-                    tracks_display = session_state["pending_playlist"].get("tracks_display", [])
-                    
-                    added_count = 0
-                    for query in args.get("tracks") or []:
-                        try:
-                            result = search_spotify_songs(
-                                query=query,
-                                type="track",
-                                limit=1,
-                            )
-                            items = (result.get("tracks") or {}).get("items") or []
-                            if items:
-                                t = items[0]
-                                track_ids.append(t["id"])
-                                artists = ", ".join(a["name"] for a in t.get("artists") or [])
-                                
-                                images = t.get("album", {}).get("images", [])
-                                cover_image = images[0].get("url") if images else ""
-                                
-                                tracks_display.append({
-                                    "name": t.get("name", query), 
-                                    "artists": artists, 
-                                    "url": t.get("external_urls", {}).get("spotify", ""),
-                                    "image": cover_image
-                                })
-                                added_count += 1
-                        except Exception:
-                            pass
-                    
-                    session_state["pending_playlist"]["track_ids"] = track_ids
-                    session_state["pending_playlist"]["tracks_display"] = tracks_display
-                    if session_id:
-                        save_session(session_id, session_state)
+                    resolved = await _resolve_track_queries(args.get("tracks") or [], emit)
+                    added_count = session_store.append_tracks(
+                        session_state,
+                        [(track_id, display) for track_id, display in resolved if track_id],
+                    )
                     
                     user_text = f"Added {added_count} tracks to the proposed playlist. Click **Review** below to see the updated tracks."
 
@@ -376,63 +862,61 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not session_state.get("pending_playlist"):
                     user_text = "There is no pending playlist to remove tracks from."
                 else:
-                    track_names_to_remove = set(name.lower() for name in (args.get("track_names") or []))
-                    track_ids = session_state["pending_playlist"].get("track_ids", [])
-                    tracks_display = session_state["pending_playlist"].get("tracks_display", [])
-                    
-                    new_track_ids = []
-                    new_tracks_display = []
-                    removed_count = 0
-                    
-                    for track_id, track_info in zip(track_ids, tracks_display):
-                        track_name_lower = track_info["name"].lower()
-                        matched = False
-                        if track_name_lower in track_names_to_remove:
-                            matched = True
-                        else:
-                            for name_to_remove in track_names_to_remove:
-                                if name_to_remove in track_name_lower:
-                                    matched = True
-                                    break
-                        
-                        if matched:
-                            removed_count += 1
-                        else:
-                            new_track_ids.append(track_id)
-                            new_tracks_display.append(track_info)
-                            
-                    session_state["pending_playlist"]["track_ids"] = new_track_ids
-                    session_state["pending_playlist"]["tracks_display"] = new_tracks_display
-                    if session_id:
-                        save_session(session_id, session_state)
+                    removed_count = session_store.remove_tracks_by_name(
+                        session_state,
+                        args.get("track_names") or [],
+                    )
                         
                     user_text = f"Removed {removed_count} tracks from the proposed playlist. Click **Review** below to see the updated tracks."
 
             elif function_name == "confirmAndCreatePlaylist" and session_state.get("pending_playlist"):
                 proposal = session_state["pending_playlist"]
                 track_ids = proposal.get("track_ids") or []
+                emit("progress", {"stage": "creating_playlist", "total": len(track_ids)})
                 try:
-                    playlist = create_playlist(
-                        name=proposal["name"],
-                        description=proposal.get("description"),
-                        public=False,
-                        request=req,
-                    )
+                    if proposal.get("playlist_id"):
+                        # An earlier confirm created the playlist but couldn't add every track
+                        playlist = {
+                            "id": proposal["playlist_id"],
+                            "name": proposal["name"],
+                            "external_urls": {"spotify": f"https://open.spotify.com/playlist/{proposal['playlist_id']}"},
+                        }
+                    else:
+                        playlist = await create_playlist(
+                            name=proposal["name"],
+                            description=proposal.get("description"),
+                            public=False,
+                            request=req,
+                        )
+                    added = 0
+                    unwritten = []
                     if track_ids:
-                        add_tracks_to_playlist(
+                        write_result = await add_tracks_to_playlist(
                             playlist_id=playlist["id"],
                             track_ids=track_ids,
                             request=req,
                         )
-                    session_state["awaiting_confirmation"] = False
-                    session_state["pending_playlist"] = None
-                    if session_id:
-                        save_session(session_id, session_state)
+                        added = write_result.get("written", 0)
+                        found = [entry for entry in session_state["entries"] if entry["id"]]
+                        unwritten = [
+                            (entry["id"], entry["display"])
+                            for chunk in write_result.get("chunks", []) if chunk["status"] != "ok"
+                            for entry in found[chunk["offset"]:chunk["offset"] + chunk["count"]]
+                        ]
                     ext = (playlist.get("external_urls") or {}).get("spotify", "")
+                    if unwritten:
+                        # Keep what didn't make it, so confirming again adds it to the same playlist
+                        session_store.replace_proposal(
+                            session_state, proposal["name"], proposal.get("description"), unwritten,
+                            playlist_id=playlist["id"],
+                        )
+                    else:
+                        session_store.clear_proposal(session_state)
                     
                     user_text = (
                         f'Playlist "{playlist["name"]}" created successfully.\n'
-                        f'Added {len(track_ids)} tracks.\n'
+                        f'Added {added} tracks.\n'
+                        + (f'{len(unwritten)} tracks could not be added. They are still in the proposal; confirm again to add them to this playlist.\n' if unwritten else '')
                         + (f'View on Spotify: {ext}' if ext else '')
                     )
                 except Exception as e:
@@ -445,10 +929,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 user_text = "There's no pending playlist to create. Ask me to propose one first, then confirm when you're ready."
 
             elif function_name == "deleteProposedPlaylist" and session_state.get("pending_playlist"):
-                session_state["pending_playlist"] = None
-                session_state["awaiting_confirmation"] = False
-                if session_id:
-                    save_session(session_id, session_state)
+                session_store.clear_proposal(session_state)
                 user_text = "The proposed playlist has been discarded."
 
             elif function_name == "deleteProposedPlaylist" and not session_state.get("pending_playlist"):
@@ -457,7 +938,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
             elif function_name == "getUserTopArtists":
                 time_range = _normalize_time_range(args.get("time_range"))
                 limit = _clamp_int(args.get("limit"), default=10, minimum=1, maximum=25)
-                artists = get_user_top_artists_data(
+                artists = await get_user_top_artists_data(
                     request=req,
                     time_range=time_range,
                     limit=limit,
@@ -465,7 +946,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not artists:
                     user_text = "I couldn't access your top artists right now. Make sure you're logged in to Spotify and have enough listening history."
                 else:
-                    user_text = _generate_taste_analysis_response(
+                    user_text = await _generate_taste_analysis_response(
                         user_message=request.message,
                         history=formatted_history,
                         tool_name=function_name,
@@ -478,7 +959,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
             elif function_name == "getUserTopTracks":
                 time_range = _normalize_time_range(args.get("time_range"))
                 limit = _clamp_int(args.get("limit"), default=10, minimum=1, maximum=25)
-                tracks = get_user_top_tracks_data(
+                tracks = await get_user_top_tracks_data(
                     request=req,
                     time_range=time_range,
                     limit=limit,
@@ -486,7 +967,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not tracks:
                     user_text = "I couldn't access your top tracks right now. Make sure you're logged in to Spotify and have enough listening history."
                 else:
-                    user_text = _generate_taste_analysis_response(
+                    user_text = await _generate_taste_analysis_response(
                         user_message=request.message,
                         history=formatted_history,
                         tool_name=function_name,
@@ -500,7 +981,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 time_range = _normalize_time_range(args.get("time_range"))
                 artist_limit = _clamp_int(args.get("artist_limit"), default=20, minimum=1, maximum=50)
                 genre_limit = _clamp_int(args.get("genre_limit"), default=10, minimum=1, maximum=20)
-                genres = get_user_top_genres_data(
+                genres = await get_user_top_genres_data(
                     request=req,
                     time_range=time_range,
                     artist_limit=artist_limit,
@@ -509,7 +990,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not genres:
                     user_text = "I couldn't derive your top genres right now. Make sure you're logged in to Spotify and have enough listening history."
                 else:
-                    user_text = _generate_taste_analysis_response(
+                    user_text = await _generate_taste_analysis_response(
                         user_message=request.message,
                         history=formatted_history,
                         tool_name=function_name,
@@ -524,7 +1005,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 artist_limit = _clamp_int(args.get("artist_limit"), default=10, minimum=1, maximum=25)
                 track_limit = _clamp_int(args.get("track_limit"), default=10, minimum=1, maximum=25)
                 genre_limit = _clamp_int(args.get("genre_limit"), default=10, minimum=1, maximum=20)
-                profile = get_user_taste_profile_data(
+                profile = await get_user_taste_profile_data(
                     request=req,
                     time_range=time_range,
                     artist_limit=artist_limit,
@@ -538,7 +1019,7 @@ async def chat_endpoint(req: Request, request: ChatRequest):
                 if not has_profile_data:
                     user_text = "I couldn't access your Spotify taste profile right now. Make sure you're logged in to Spotify and have enough listening history."
                 else:
-                    user_text = _generate_taste_analysis_response(
+                    user_text = await _generate_taste_analysis_response(
                         user_message=request.message,
                         history=formatted_history,
                         tool_name=function_name,
@@ -551,52 +1032,39 @@ async def chat_endpoint(req: Request, request: ChatRequest):
         # Normal Text Response
         # -------------------------
         else:
-            try:
-                user_text = response.text
-            except Exception:
-                user_text = "I'm sorry, I couldn't generate a proper response. Please try again."
+            user_text = response_text or "I'm sorry, I couldn't generate a proper response. Please try again."
 
 
         
-        # Update history (Frontend expects this)
-        updated_history = request.history + [
+        turn = [
             ChatHistoryItem(role="user", parts=[request.message]),
             ChatHistoryItem(role="model", parts=[user_text])
         ]
         
-        # Save to Supabase if session_id is present
+        # One Redis write for everything this turn changed, including the new messages
         if session_id:
-            try:
-                # Save user message
-                supabase.table("chat_messages").insert({
-                    "session_id": session_id,
-                    "role": "user",
-                    "content": request.message
-                }).execute()
-                
-                # Save model message
-                supabase.table("chat_messages").insert({
-                    "session_id": session_id,
-                    "role": "model",
-                    "content": user_text
-                }).execute()
-                
-                # Update session updated_at
-                supabase.table("chat_sessions").update({
-                    "updated_at": datetime.now().isoformat()
-                }).eq("id", session_id).execute()
-                
-            except Exception as e:
-                print(f"Failed to save chat history: {e}")
-                # Don't fail the request, just log error
-
-        return {
+            session_store.append_history(session_state, "user", request.message)
+            session_store.append_history(session_state, "model", user_text)
+            await session_store.save(session_state)
+            _schedule_fold(session_state)
+
+        # Save to Supabase if session_id is present, after the response goes out
+        if session_id:
+            enqueue_chat_turn(session_id, request.message, user_text, turn_started_at)
+
+        result = {
             "text": user_text,
-            "history": updated_history,
+            "turn": turn,
             "is_awaiting_confirmation": session_state.get("awaiting_confirmation", False),
             "pending_playlist": session_state.get("pending_playlist")
         }
+        # Session-less chats still carry their own history
+        if not session_id:
+            result["history"] = request.history + turn
+        return result
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Chat Error: {e}") 
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
@@ -9,6 +9,7 @@ class ChatHistoryItem(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # Only used without a session_id; sessions keep their history on the server
     history: list[ChatHistoryItem] = []
     session_id: str | None = None
     pending_playlist_override: dict | None = None
@@ -33,4 +34,7 @@ class MessageResponse(BaseModel):
 class SessionMessagesResponse(BaseModel):
     messages: list[MessageResponse]
     is_awaiting_confirmation: bool = False
-    pending_playlist: dict | None = None
\ No newline at end of file
+    pending_playlist: dict | None = None
+    has_more: bool = False
+    older_cursor: str | None = None
+    newer_cursor: str | None = None
\ No newline at end of file
@@ -1,14 +1,17 @@
 from fastapi import APIRouter, HTTPException, Request, Response, Depends
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse
+import asyncio
 import urllib.parse
-import urllib.request
-import urllib.error
-import json
 import base64
+import hashlib
+import json
 import secrets
 from collections import Counter
 from datetime import datetime
 import os
+from backend import spotify_client, audio_features_store, search_cache
+from backend.spotify_client import SpotifyHTTPError
+from backend.redis_client import r
 from backend.routers.spotify_models import (
     CreatePlaylistRequest,
     AddTracksRequest,
@@ -20,46 +23,95 @@ from backend.routers.spotify_models import (
 )
 
 API_BASE_URL = "https://api.spotify.com/v1"
+TOKEN_URL = "https://accounts.spotify.com/api/token"
 STATE_TTL = 300
+PLAYLIST_PAGE_SIZE = 100
+# Pages of one playlist fetched at once when the whole playlist is requested; kept
+# within the shared fan-out cap so one big playlist doesn't trip Spotify's rate limit
+PLAYLIST_PAGE_CONCURRENCY = int(os.getenv("PLAYLIST_PAGE_CONCURRENCY", str(spotify_client.SPOTIFY_FANOUT_CONCURRENCY)))
+PLAYLIST_PAGE_RETRIES = int(os.getenv("PLAYLIST_PAGE_RETRIES", "3"))
+# Bulk playlist writes: Spotify accepts at most 100 URIs per add/remove call
+PLAYLIST_WRITE_CHUNK = 100
+PLAYLIST_WRITE_RETRIES = int(os.getenv("PLAYLIST_WRITE_RETRIES", "3"))
+PLAYLIST_WRITE_BACKOFF_SECONDS = float(os.getenv("PLAYLIST_WRITE_BACKOFF_SECONDS", "0.5"))
+# A Retry-After longer than this fails the chunk instead of holding the request open
+PLAYLIST_WRITE_MAX_WAIT_SECONDS = float(os.getenv("PLAYLIST_WRITE_MAX_WAIT_SECONDS", "30"))
+# Per-playlist track fetches for the AI context: concurrency cap and total time budget
+PLAYLIST_CONTEXT_CONCURRENCY = int(os.getenv("PLAYLIST_CONTEXT_CONCURRENCY", "10"))
+PLAYLIST_CONTEXT_BUDGET_SECONDS = float(os.getenv("PLAYLIST_CONTEXT_BUDGET_SECONDS", "3"))
+# How long the rendered AI context stays cached per user (our own writes invalidate it sooner)
+AI_CONTEXT_TTL = int(os.getenv("AI_CONTEXT_TTL", "900"))
+# ...or only briefly when it is partial (playlists skipped over budget or a fetch failed)
+AI_CONTEXT_PARTIAL_TTL = int(os.getenv("AI_CONTEXT_PARTIAL_TTL", "60"))
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI") or "http://127.0.0.1:8000/api/spotify/auth/callback"
 
 router = APIRouter()
 
-# --- App Token Implementation (Client Credentials) ---
-_cached_token = {"token": None, "expires_at": 0}
 
-def get_app_token():
-    now = datetime.now().timestamp()
-
-    if _cached_token["token"] and now < _cached_token["expires_at"] - 60:
-        return _cached_token["token"]
-        
-    token_url = "https://accounts.spotify.com/api/token"
-    
+async def _spotify_token_request(data: dict) -> dict:
+    """POST a grant to the Spotify accounts service using the app's client credentials."""
     auth_str = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
     auth_b64 = base64.b64encode(auth_str.encode()).decode()
-    
     headers = {
         "Authorization": f"Basic {auth_b64}",
-        "Content-Type": "application/x-www-form-urlencoded"
+        "Content-Type": "application/x-www-form-urlencoded",
     }
-    data = urllib.parse.urlencode({"grant_type": "client_credentials"}).encode()
-    
-    try:
-        req = urllib.request.Request(token_url, data=data, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            body = json.loads(resp.read().decode())
-            _cached_token["token"] = body["access_token"]
-            _cached_token["expires_at"] = now + body["expires_in"]
+    return await spotify_client.request_json("POST", TOKEN_URL, headers=headers, data=data)
+
+# --- App Token Implementation (Client Credentials) ---
+_cached_token = {"token": None, "expires_at": 0}
+# Single-flight: concurrent callers with an expired token wait on one fetch.
+_app_token_lock = asyncio.Lock()
+# The background refresher renews this long before expiry, so request paths never wait.
+APP_TOKEN_REFRESH_MARGIN = int(os.getenv("APP_TOKEN_REFRESH_MARGIN", "300"))
+APP_TOKEN_RETRY_SECONDS = 30
+
+
+def _app_token_valid(now: float) -> bool:
+    return bool(_cached_token["token"]) and now < _cached_token["expires_at"] - 60
+
+
+async def _refresh_app_token():
+    body = await _spotify_token_request({"grant_type": "client_credentials"})
+    _cached_token["token"] = body["access_token"]
+    _cached_token["expires_at"] = datetime.now().timestamp() + body["expires_in"]
+    return _cached_token["token"]
+
+
+async def get_app_token():
+    if _app_token_valid(datetime.now().timestamp()):
+        return _cached_token["token"]
+
+    async with _app_token_lock:
+        # Another caller may have refreshed it while we waited for the lock
+        if _app_token_valid(datetime.now().timestamp()):
             return _cached_token["token"]
-    except Exception as e:
-        print(f"Failed to fetch Spotify token: {e}")
-        return None
+        try:
+            return await _refresh_app_token()
+        except Exception as e:
+            print(f"Failed to fetch Spotify token: {e}")
+            return None
+
+
+async def app_token_refresher():
+    """Keep the app token fresh in the background; started from the app lifespan."""
+    while True:
+        delay = _cached_token["expires_at"] - APP_TOKEN_REFRESH_MARGIN - datetime.now().timestamp()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            async with _app_token_lock:
+                await _refresh_app_token()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Failed to refresh Spotify token: {e}")
+            await asyncio.sleep(APP_TOKEN_RETRY_SECONDS)
 
 
-def _get_valid_user_access_token(request: Request):
+async def _get_valid_user_access_token(request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -74,7 +126,7 @@ def _get_valid_user_access_token(request: Request):
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Session expired")
         access_token = token_data.get("access_token")
@@ -84,48 +136,174 @@ def _get_valid_user_access_token(request: Request):
     return access_token, expires_at, new_cookie_needed
 
 
-def _spotify_json_request(url: str, headers: dict, method: str = "GET", payload=None, timeout: int = 10):
-    data_bytes = None
-    if payload is not None:
-        data_bytes = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data_bytes, headers=headers, method=method)
-    with urllib.request.urlopen(req, timeout=timeout) as resp:
-        body = resp.read()
-        if not body:
-            return None
-        return json.loads(body.decode("utf-8"))
+async def _spotify_json_request(url: str, headers: dict, method: str = "GET", payload=None, timeout: int = 10):
+    return await spotify_client.request_json(method, url, headers=headers, json=payload, timeout=timeout)
 
 # --- Helper: Token Refresh Logic ---
-def handle_token_refresh(refresh_token: str):
-    """Helper to refresh Spotify token using urllib"""
+# One refresh per expiry: callers in this process share the in-flight refresh and
+# its result, and workers coordinate through a Redis lock keyed by the refresh token.
+TOKEN_REFRESH_LOCK_TTL = 10
+_token_refreshes: dict[str, asyncio.Future] = {}
+_refreshed_tokens: dict[str, dict] = {}
+
+
+def _refresh_key(refresh_token: str) -> str:
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+def _fresh_token_data(token_data: dict | None) -> dict | None:
+    """Return the cached token data with `expires_in` recomputed, or None once it is near expiry."""
+    if not token_data:
+        return None
+    expires_in = int(token_data.get("expires_at", 0) - datetime.now().timestamp())
+    if expires_in <= 60:
+        return None
+    return {**token_data, "expires_in": expires_in}
+
+
+def _remember_refreshed_token(key: str, token_data: dict):
+    now = datetime.now().timestamp()
+    for stale_key in [k for k, v in _refreshed_tokens.items() if v.get("expires_at", 0) <= now]:
+        del _refreshed_tokens[stale_key]
+    _refreshed_tokens[key] = token_data
+
+
+async def _read_shared_refresh(key: str) -> dict | None:
+    raw = await r.get(f"token_refresh:{key}")
+    return _fresh_token_data(json.loads(raw)) if raw else None
+
+
+async def _refresh_user_token_once(key: str, refresh_token: str):
+    lock_key = f"token_refresh_lock:{key}"
+    got_lock = False
+    try:
+        token_data = await _read_shared_refresh(key)
+        if not token_data:
+            got_lock = bool(await r.set(lock_key, "1", nx=True, ex=TOKEN_REFRESH_LOCK_TTL))
+            if not got_lock:
+                # Another worker is refreshing this token; wait for its result, or for it to give up
+                for _ in range(TOKEN_REFRESH_LOCK_TTL * 10):
+                    await asyncio.sleep(0.1)
+                    token_data = await _read_shared_refresh(key)
+                    if token_data or not await r.exists(lock_key):
+                        break
+        if token_data:
+            _remember_refreshed_token(key, token_data)
+            return token_data
+    except Exception as e:
+        print(f"Token refresh lock unavailable: {e}")
+
+    try:
+        try:
+            token_data = await _spotify_token_request({
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+            })
+        except Exception as e:
+            print(f"Token refresh failed: {e}")
+            return None
+
+        token_data["expires_at"] = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
+        _remember_refreshed_token(key, token_data)
+        try:
+            await r.set(f"token_refresh:{key}", json.dumps(token_data), ex=max(int(token_data.get("expires_in") or 0) - 60, 1))
+        except Exception as e:
+            print(f"Failed to share refreshed token: {e}")
+        return token_data
+    finally:
+        if got_lock:
+            try:
+                await r.delete(lock_key)
+            except Exception as e:
+                print(f"Failed to release token refresh lock: {e}")
+
+
+async def handle_token_refresh(refresh_token: str):
+    """Helper to refresh Spotify token through the shared Spotify client, once per expiry"""
     if not refresh_token:
         return None
 
-    token_url = "https://accounts.spotify.com/api/token"
-    
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-    }
-    auth_str = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-    auth_value = base64.b64encode(auth_str.encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth_value}",
-        "Content-Type": "application/x-www-form-urlencoded",
+    key = _refresh_key(refresh_token)
+    token_data = _fresh_token_data(_refreshed_tokens.get(key))
+    if token_data:
+        return token_data
+
+    refresh = _token_refreshes.get(key)
+    if refresh is None:
+        refresh = asyncio.ensure_future(_refresh_user_token_once(key, refresh_token))
+        _token_refreshes[key] = refresh
+        refresh.add_done_callback(lambda _: _token_refreshes.pop(key, None))
+    return await asyncio.shield(refresh)
+
+
+async def refresh_user_token(request: Request, refresh_token: str):
+    """Refresh at most once per request. The refreshed token is kept on request.state
+    so the cookie middleware can send it back even from helper code paths."""
+    token_data = getattr(request.state, "refreshed_token", None)
+    if token_data is None:
+        token_data = await handle_token_refresh(refresh_token)
+        if token_data:
+            request.state.refreshed_token = token_data
+    return token_data
+
+
+def set_refreshed_token_cookies(resp: Response, token_data: dict):
+    """Attach refreshed token cookies the route did not already set itself."""
+    already_set = {
+        header.split("=", 1)[0]
+        for header in resp.headers.getlist("set-cookie")
     }
+    if "access_token" not in already_set:
+        resp.set_cookie("access_token", token_data.get("access_token") or "", httponly=True, samesite="lax")
+    if "expires_at" not in already_set:
+        resp.set_cookie("expires_at", str(int(token_data.get("expires_at") or 0)), httponly=True, samesite="lax")
+    if token_data.get("refresh_token") and "refresh_token" not in already_set:
+        resp.set_cookie("refresh_token", token_data["refresh_token"], httponly=True, samesite="lax")
+
+# --- Helper: User ID Lookup ---
+# An access token always belongs to the same user, so the /me lookup is cached per
+# token (by hash) until the token expires, in memory and in Redis for other workers.
+_user_ids: dict[str, tuple[str, float]] = {}
+
+
+async def lookup_user_id(access_token: str, expires_at: float | None = None) -> str | None:
+    """Spotify user ID for an access token. Raises SpotifyHTTPError if /me fails."""
+    key = hashlib.sha256(access_token.encode()).hexdigest()
+    now = datetime.now().timestamp()
+    cached = _user_ids.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+
+    # Spotify access tokens live for an hour; use that when the expiry is unknown
+    if not expires_at or expires_at <= now:
+        expires_at = now + 3600
 
     try:
-        encoded = urllib.parse.urlencode(data).encode()
-        req = urllib.request.Request(token_url, data=encoded, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            body_text = resp.read().decode("utf-8")
-            return json.loads(body_text)
+        cached_id = await r.get(f"spotify_user:{key}")
+        if cached_id:
+            user_id = cached_id.decode() if isinstance(cached_id, bytes) else cached_id
+            _user_ids[key] = (user_id, expires_at)
+            return user_id
     except Exception as e:
-        print(f"Token refresh failed: {e}")
+        print(f"Failed to read cached user ID: {e}")
+
+    data = await _spotify_json_request(f"{API_BASE_URL}/me", {"Authorization": f"Bearer {access_token}"})
+    user_id = (data or {}).get("id")
+    if not user_id:
         return None
 
+    for stale_key in [k for k, (_, exp) in _user_ids.items() if exp <= now]:
+        del _user_ids[stale_key]
+    _user_ids[key] = (user_id, expires_at)
+    try:
+        await r.set(f"spotify_user:{key}", user_id, ex=max(int(expires_at - now), 1))
+    except Exception as e:
+        print(f"Failed to cache user ID: {e}")
+    return user_id
+
+
 # --- FastAPI Authentication Dependency ---
-def get_current_user_id(request: Request) -> str:
+async def get_current_user_id(request: Request) -> str:
     """FastAPI dependency to get the current authenticated user's Spotify ID."""
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
@@ -140,20 +318,15 @@ def get_current_user_id(request: Request) -> str:
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Session expired. Please log in again.")
         access_token = token_data.get("access_token")
+        expires_at = token_data.get("expires_at")
 
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"{API_BASE_URL}/me"
-    
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            return data.get("id")
-    except urllib.error.HTTPError as he:
+        return await lookup_user_id(access_token, expires_at)
+    except SpotifyHTTPError as he:
         if he.code == 401:
             raise HTTPException(status_code=401, detail="Spotify token invalid or expired.")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
@@ -164,7 +337,7 @@ def get_current_user_id(request: Request) -> str:
 # --- Auth Routes ---
 
 @router.get("/auth/login")
-def login():
+async def login():
     scope = (
         "user-read-private user-read-email user-top-read "
         "user-read-recently-played user-read-currently-playing user-read-playback-state "
@@ -187,7 +360,7 @@ def login():
     return resp
 
 @router.get("/auth/callback")
-def callback(request: Request, code: str | None = None, state: str | None = None, error: str | None = None):
+async def callback(request: Request, code: str | None = None, state: str | None = None, error: str | None = None):
     if error or not code:
         return RedirectResponse(url="/")
 
@@ -198,33 +371,14 @@ def callback(request: Request, code: str | None = None, state: str | None = None
     if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
         return RedirectResponse(url="/")
 
-    token_url = "https://accounts.spotify.com/api/token"
     data = {
         "grant_type": "authorization_code",
         "code": code,
         "redirect_uri": REDIRECT_URI,
     }
-    
-    auth_str = f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}"
-    auth_value = base64.b64encode(auth_str.encode()).decode()
-    headers = {
-        "Authorization": f"Basic {auth_value}",
-        "Content-Type": "application/x-www-form-urlencoded",
-    }
 
     try:
-        encoded = urllib.parse.urlencode(data).encode()
-        req = urllib.request.Request(token_url, data=encoded, headers=headers, method="POST")
-        
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            status = resp.getcode()
-            body_text = resp.read().decode("utf-8")
-            
-        if status < 200 or status >= 300:
-            return RedirectResponse(url="/")
-
-        token_data = json.loads(body_text)
-        
+        token_data = await _spotify_token_request(data)
     except Exception:
         return RedirectResponse(url="/")
 
@@ -243,7 +397,7 @@ def callback(request: Request, code: str | None = None, state: str | None = None
     return resp
 
 @router.post("/auth/logout")
-def logout(response: Response):
+async def logout(response: Response):
     response.delete_cookie("access_token", path="/")
     response.delete_cookie("refresh_token", path="/")
     response.delete_cookie("expires_at", path="/")
@@ -251,7 +405,7 @@ def logout(response: Response):
     return {"message": "Logged out"}
 
 @router.get("/auth/status")
-def auth_status(request: Request):
+async def auth_status(request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -273,8 +427,49 @@ def auth_status(request: Request):
 
 # --- Data Routes ---
 
+def _format_playlist_summary(p: dict) -> dict:
+    return {
+        "id": p.get("id"),
+        "name": p.get("name"),
+        "owner": (p.get("owner") or {}).get("display_name") or (p.get("owner") or {}).get("id"),
+        "owner_id": (p.get("owner") or {}).get("id"),
+        "tracks_total": (p.get("tracks") or {}).get("total"),
+        "images": p.get("images", []),
+        "public": p.get("public"),
+        "external_url": (p.get("external_urls") or {}).get("spotify"),
+    }
+
+
+async def _ndjson_pages(first_page: dict, headers: dict, format_item):
+    """Yield one NDJSON line per formatted item, page by page.
+
+    The next page is only requested once the current one has been handed to the
+    client, so at most one upstream page is held in memory. A failure mid-stream
+    is reported as a final {"error": ...} line.
+    """
+    page = first_page
+    while page:
+        for item in page.get("items", []):
+            formatted = format_item(item)
+            if formatted:
+                yield json.dumps(formatted) + "\n"
+        next_url = page.get("next")
+        if not next_url:
+            return
+        try:
+            page = await _get_playlist_page(next_url, headers)
+        except Exception as e:
+            yield json.dumps({"error": f"Spotify API Error: {e}"}) + "\n"
+            return
+
+
 @router.get("/playlists")
-def get_playlists(request: Request):
+async def get_playlists(request: Request, stream: bool = False):
+    """List the user's playlists.
+
+    With `stream=true` the response is NDJSON, one playlist per line, flushed as
+    each upstream page arrives.
+    """
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -289,7 +484,7 @@ def get_playlists(request: Request):
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
              raise HTTPException(status_code=401, detail="Session expired")
         
@@ -303,41 +498,112 @@ def get_playlists(request: Request):
     url = f"{API_BASE_URL}/me/playlists"
     
     while url:
-        req = urllib.request.Request(url, headers=headers, method="GET")
         try:
-            with urllib.request.urlopen(req, timeout=10) as resp:
-                body_text = resp.read().decode("utf-8")
-                data = json.loads(body_text)
-                items.extend(data.get("items", []))
-                url = data.get("next")
-        except urllib.error.HTTPError as he:
+            data = await _spotify_json_request(url, headers)
+        except SpotifyHTTPError as he:
             if he.code == 401:
                 return RedirectResponse(url="/api/auth/login")
             raise HTTPException(status_code=502, detail=f"Spotify API Error: {he}")
         except Exception as e:
              raise HTTPException(status_code=502, detail=f"Spotify API Error: {e}")
+        if stream:
+            # First page fetched above so errors still get a status code; stream the rest
+            break
+        items.extend(data.get("items", []))
+        url = data.get("next")
 
-    playlists = []
-    for p in items:
-        playlists.append({
-            "id": p.get("id"),
-            "name": p.get("name"),
-            "owner": (p.get("owner") or {}).get("display_name") or (p.get("owner") or {}).get("id"),
-            "owner_id": (p.get("owner") or {}).get("id"),
-            "tracks_total": (p.get("tracks") or {}).get("total"),
-            "images": p.get("images", []),
-            "public": p.get("public"),
-            "external_url": (p.get("external_urls") or {}).get("spotify"),
-        })
-
-    resp = JSONResponse({"playlists": playlists})
+    if stream:
+        resp = StreamingResponse(
+            _ndjson_pages(data, headers, _format_playlist_summary),
+            media_type="application/x-ndjson",
+        )
+    else:
+        resp = JSONResponse({"playlists": [_format_playlist_summary(p) for p in items]})
     if new_cookie_needed:
         resp.set_cookie("access_token", access_token, httponly=True, samesite="lax")
         resp.set_cookie("expires_at", str(int(expires_at)), httponly=True, samesite="lax")
     return resp
 
+def _format_playlist_item(item: dict) -> dict | None:
+    track_obj = item.get("track")
+    if not track_obj:
+        return None
+    return {
+        "added_at": item.get("added_at"),
+        "track": {
+            "id": track_obj.get("id"),
+            "name": track_obj.get("name"),
+            "duration_ms": track_obj.get("duration_ms"),
+            "uri": track_obj.get("uri"),
+            "external_urls": track_obj.get("external_urls", {}),
+            "album": {
+                "id": track_obj.get("album", {}).get("id"),
+                "name": track_obj.get("album", {}).get("name"),
+                "images": track_obj.get("album", {}).get("images", []),
+            },
+            "artists": [
+                {"id": a.get("id"), "name": a.get("name"), "external_urls": a.get("external_urls", {})}
+                for a in track_obj.get("artists", [])
+            ]
+        }
+    }
+
+
+async def _get_playlist_page(url: str, headers: dict) -> dict:
+    """GET one page of playlist tracks, retrying 429 (after its Retry-After) and 5xx answers."""
+    for attempt in range(1, PLAYLIST_PAGE_RETRIES + 2):
+        try:
+            return await _spotify_json_request(url, headers)
+        except SpotifyHTTPError as he:
+            wait = he.retry_after if he.retry_after is not None else PLAYLIST_WRITE_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            if (he.code == 429 or he.code >= 500) and attempt <= PLAYLIST_PAGE_RETRIES and wait <= PLAYLIST_WRITE_MAX_WAIT_SECONDS:
+                await asyncio.sleep(wait)
+                continue
+            raise
+
+
+async def _fetch_remaining_playlist_items(playlist_id: str, headers: dict, first_page: dict) -> tuple[list[dict], int]:
+    """Fetch every page after `first_page` concurrently.
+
+    Returns the items in playlist order and the number of pages that still failed
+    after retries; those are left out rather than failing the whole playlist.
+    A 401 is raised as SpotifyHTTPError.
+    """
+    total = first_page.get("total") or 0
+    page_size = first_page.get("limit") or PLAYLIST_PAGE_SIZE
+    offsets = range(len(first_page.get("items", [])), total, page_size)
+
+    async def fetch_page(offset: int) -> list[dict] | None:
+        params = {"offset": offset, "limit": page_size}
+        url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks?{urllib.parse.urlencode(params)}"
+        try:
+            data = await _get_playlist_page(url, headers)
+        except SpotifyHTTPError as he:
+            if he.code == 401:
+                raise
+            print(f"Failed to fetch playlist {playlist_id} page at offset {offset}: {he}")
+            return None
+        except Exception as e:
+            print(f"Failed to fetch playlist {playlist_id} page at offset {offset}: {e}")
+            return None
+        return (data or {}).get("items", [])
+
+    pages = await spotify_client.gather_limited(
+        *(fetch_page(offset) for offset in offsets),
+        limit=PLAYLIST_PAGE_CONCURRENCY,
+    )
+    items = [item for page in pages if page for item in page]
+    return items, sum(1 for page in pages if page is None)
+
+
 @router.get("/playlists/{playlist_id}")
-def get_playlist_details(playlist_id: str, request: Request):
+async def get_playlist_details(playlist_id: str, request: Request, all_tracks: bool = False, stream: bool = False):
+    """Playlist metadata and tracks.
+
+    `all_tracks=true` returns every track instead of the first page. `stream=true`
+    returns NDJSON instead: the first line is the playlist metadata (tracks has
+    only `total`), then one track item per line across all pages.
+    """
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -352,7 +618,7 @@ def get_playlist_details(playlist_id: str, request: Request):
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
              raise HTTPException(status_code=401, detail="Session expired")
         
@@ -362,43 +628,30 @@ def get_playlist_details(playlist_id: str, request: Request):
 
     headers = {"Authorization": f"Bearer {access_token}"}
     url = f"{API_BASE_URL}/playlists/{playlist_id}"
-    
+
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
     # Formatting logic
     tracks_data = data.get("tracks", {})
-    items_raw = tracks_data.get("items", [])
-    formatted_tracks = []
-
-    for item in items_raw:
-        track_obj = item.get("track")
-        if not track_obj: continue
-            
-        formatted_tracks.append({
-            "added_at": item.get("added_at"),
-            "track": {
-                "id": track_obj.get("id"),
-                "name": track_obj.get("name"),
-                "duration_ms": track_obj.get("duration_ms"),
-                "uri": track_obj.get("uri"),
-                "external_urls": track_obj.get("external_urls", {}),
-                "album": {
-                    "id": track_obj.get("album", {}).get("id"),
-                    "name": track_obj.get("album", {}).get("name"),
-                    "images": track_obj.get("album", {}).get("images", []),
-                },
-                "artists": [
-                    {"id": a.get("id"), "name": a.get("name"), "external_urls": a.get("external_urls", {})} 
-                    for a in track_obj.get("artists", [])
-                ]
-            }
-        })
+    items_raw = list(tracks_data.get("items", []))
+
+    # The playlist object embeds only the first page; fetch the rest in parallel
+    failed_pages = 0
+    if all_tracks and not stream and tracks_data.get("next"):
+        try:
+            remaining, failed_pages = await _fetch_remaining_playlist_items(playlist_id, headers, tracks_data)
+            items_raw.extend(remaining)
+        except SpotifyHTTPError as he:
+            if he.code == 401: return RedirectResponse(url="/api/auth/login")
+            raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+
+    formatted_tracks = [
+        formatted for formatted in (_format_playlist_item(item) for item in items_raw) if formatted
+    ]
 
     data_resp = {
         "id": data.get("id"),
@@ -414,15 +667,28 @@ def get_playlist_details(playlist_id: str, request: Request):
         "external_urls": (data.get("external_urls") or {}).get("spotify"),
         "tracks": {"total": tracks_data.get("total"), "items": formatted_tracks}
     }
+    if failed_pages:
+        # Some pages still failed after retries; the items that did arrive are returned
+        data_resp["tracks"]["incomplete"] = True
 
-    resp = JSONResponse(data_resp)
+    if stream:
+        data_resp["tracks"] = {"total": tracks_data.get("total")}
+
+        async def stream_playlist():
+            yield json.dumps(data_resp) + "\n"
+            async for line in _ndjson_pages(tracks_data, headers, _format_playlist_item):
+                yield line
+
+        resp = StreamingResponse(stream_playlist(), media_type="application/x-ndjson")
+    else:
+        resp = JSONResponse(data_resp)
     if new_cookie_needed:
         resp.set_cookie("access_token", access_token, httponly=True, samesite="lax")
         resp.set_cookie("expires_at", str(int(expires_at)), httponly=True, samesite="lax")
     return resp
 
 @router.post("/playlists")
-def create_playlist(body: CreatePlaylistRequest, request: Request):
+async def create_playlist(body: CreatePlaylistRequest, request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -435,7 +701,7 @@ def create_playlist(body: CreatePlaylistRequest, request: Request):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -444,13 +710,9 @@ def create_playlist(body: CreatePlaylistRequest, request: Request):
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     
     # 1. Get User ID
-    user_url = f"{API_BASE_URL}/me"
     try:
-        req = urllib.request.Request(user_url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            user_data = json.loads(resp.read().decode("utf-8"))
-            user_id = user_data.get("id")
-    except urllib.error.HTTPError as he:
+        user_id = await lookup_user_id(access_token, expires_at)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Failed to get user ID: {he}")
 
@@ -464,13 +726,11 @@ def create_playlist(body: CreatePlaylistRequest, request: Request):
     }
     
     try:
-        data_bytes = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            new_playlist = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        new_playlist = await _spotify_json_request(url, headers, method="POST", payload=payload)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token, user_id)
 
     resp = JSONResponse(new_playlist)
     if new_cookie_needed:
@@ -480,7 +740,7 @@ def create_playlist(body: CreatePlaylistRequest, request: Request):
     return resp
 
 @router.delete("/playlists/{playlist_id}")
-def delete_playlist(playlist_id: str, request: Request):
+async def delete_playlist(playlist_id: str, request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -493,7 +753,7 @@ def delete_playlist(playlist_id: str, request: Request):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -503,13 +763,12 @@ def delete_playlist(playlist_id: str, request: Request):
     url = f"{API_BASE_URL}/playlists/{playlist_id}/followers"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="DELETE")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            # DELETE usually returns 200 OK or 204 No Content
-            pass
-    except urllib.error.HTTPError as he:
+        # DELETE usually returns 200 OK or 204 No Content
+        await spotify_client.request("DELETE", url, headers=headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token)
 
     resp = JSONResponse({"message": "Playlist deleted (unfollowed)"})
     if new_cookie_needed:
@@ -518,8 +777,98 @@ def delete_playlist(playlist_id: str, request: Request):
     
     return resp
 
+async def _playlist_track_total(playlist_id: str, headers: dict) -> tuple[int | None, str | None]:
+    """(track total, snapshot_id) of a playlist, or (None, None) if it can't be read."""
+    try:
+        data = await _spotify_json_request(
+            f"{API_BASE_URL}/playlists/{playlist_id}?fields=snapshot_id,tracks.total", headers
+        )
+        return (data.get("tracks") or {}).get("total"), data.get("snapshot_id")
+    except Exception as e:
+        print(f"Failed to read playlist {playlist_id} total: {e}")
+        return None, None
+
+
+async def write_playlist_tracks(playlist_id: str, uris: list[str], headers: dict, remove: bool = False) -> dict:
+    """Add (or remove) any number of URIs in chunks of 100.
+
+    Chunks go out strictly one after another so added tracks keep their order,
+    and each call carries the snapshot_id returned by the previous one. 429 and
+    5xx answers are retried, waiting for Retry-After when Spotify sends one.
+    Adds are not idempotent, so before an add is retried after a 5xx the
+    playlist's track total is compared with what it was before the chunk: if
+    the chunk landed it counts as written, and if that can't be told the chunk
+    fails rather than risk adding it twice. If a chunk fails, the remaining
+    chunks are skipped and the failure is reported in `chunks`. A failure before
+    anything was written is raised as SpotifyHTTPError.
+    """
+    url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks"
+    snapshot_id = None
+    written = 0
+    failed = False
+    chunks = []
+    # Adds only: the playlist's size before this write, to check chunks after a 5xx
+    base_total = None if remove else (await _playlist_track_total(playlist_id, headers))[0]
+
+    for index, start in enumerate(range(0, len(uris), PLAYLIST_WRITE_CHUNK)):
+        chunk = uris[start:start + PLAYLIST_WRITE_CHUNK]
+        result = {"index": index, "offset": start, "count": len(chunk), "status": "skipped", "attempts": 0}
+        chunks.append(result)
+        if failed:
+            continue
+
+        if remove:
+            method = "DELETE"
+            payload = {"tracks": [{"uri": uri} for uri in chunk]}
+            if snapshot_id:
+                payload["snapshot_id"] = snapshot_id
+        else:
+            method = "POST"
+            payload = {"uris": chunk}
+
+        for attempt in range(1, PLAYLIST_WRITE_RETRIES + 2):
+            result["attempts"] = attempt
+            try:
+                data = await _spotify_json_request(url, headers, method=method, payload=payload)
+            except SpotifyHTTPError as he:
+                wait = he.retry_after if he.retry_after is not None else PLAYLIST_WRITE_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                retry = (he.code == 429 or he.code >= 500) and attempt <= PLAYLIST_WRITE_RETRIES and wait <= PLAYLIST_WRITE_MAX_WAIT_SECONDS
+                if retry and he.code >= 500 and not remove:
+                    # The add may have been applied before the error; look before sending it again
+                    total, current_snapshot = await _playlist_track_total(playlist_id, headers)
+                    expected = None if base_total is None else base_total + written
+                    if expected is not None and total == expected + len(chunk):
+                        snapshot_id = current_snapshot or snapshot_id
+                        result.update(status="ok", snapshot_id=snapshot_id)
+                        written += len(chunk)
+                        break
+                    retry = expected is not None and total == expected
+                if retry:
+                    await asyncio.sleep(wait)
+                    continue
+                if written == 0:
+                    raise
+                result.update(status="failed", error=str(he))
+                failed = True
+                break
+            snapshot_id = (data or {}).get("snapshot_id") or snapshot_id
+            result.update(status="ok", snapshot_id=snapshot_id)
+            written += len(chunk)
+            break
+
+    return {"snapshot_id": snapshot_id, "written": written, "total": len(uris), "chunks": chunks}
+
+
+def _bulk_write_response(data: dict, action: str) -> JSONResponse:
+    if data["written"] == data["total"]:
+        return JSONResponse(data)
+    failed = next((c for c in data["chunks"] if c["status"] == "failed"), {})
+    data["detail"] = f"{action} {data['written']} of {data['total']} tracks; chunk {failed.get('index')} failed: {failed.get('error')}"
+    return JSONResponse(data, status_code=502)
+
+
 @router.post("/playlists/{playlist_id}/tracks")
-def add_tracks_to_playlist(playlist_id: str, body: AddTracksRequest, request: Request):
+async def add_tracks_to_playlist(playlist_id: str, body: AddTracksRequest, request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -532,36 +881,31 @@ def add_tracks_to_playlist(playlist_id: str, body: AddTracksRequest, request: Re
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
         new_cookie_needed = True
 
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks"
-    
+
     try:
-        data_bytes = json.dumps({"uris": body.uris}).encode("utf-8")
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await write_playlist_tracks(playlist_id, body.uris, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token)
 
+    resp = _bulk_write_response(data, "Added")
     if new_cookie_needed:
-        resp = JSONResponse(data)
         resp.set_cookie("access_token", access_token, httponly=True, samesite="lax")
         resp.set_cookie("expires_at", str(int(expires_at)), httponly=True, samesite="lax")
-        return resp
-
-    return data
+    return resp
 
 
 
 @router.delete("/playlists/{playlist_id}/tracks")
-def remove_tracks_from_playlist(playlist_id: str, body: AddTracksRequest, request: Request):
+async def remove_tracks_from_playlist(playlist_id: str, body: AddTracksRequest, request: Request):
     """
     Remove tracks from a playlist.
     Expects body.uris to be a list of Spotify track URIs to remove.
@@ -578,50 +922,47 @@ def remove_tracks_from_playlist(playlist_id: str, body: AddTracksRequest, reques
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
         new_cookie_needed = True
 
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks"
-    
-    # Spotify API expects: { "tracks": [{ "uri": "spotify:track:..." }] }
-    tracks_payload = [{"uri": uri} for uri in body.uris]
-    payload = {"tracks": tracks_payload}
 
     try:
-        data_bytes = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method="DELETE")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await write_playlist_tracks(playlist_id, body.uris, headers, remove=True)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token)
 
+    resp = _bulk_write_response(data, "Removed")
     if new_cookie_needed:
-        resp = JSONResponse(data)
         resp.set_cookie("access_token", access_token, httponly=True, samesite="lax")
         resp.set_cookie("expires_at", str(int(expires_at)), httponly=True, samesite="lax")
-        return resp
-
-    return data
+    return resp
 
 
 # --- Backend helpers (for server-side use, e.g. Gemini) ---
 
-def get_user_playlists_context(request: Request, limit_tracks: int = 10) -> str:
+async def get_user_playlists_context(request: Request, limit_tracks: int = 10) -> str:
     """Fetch a brief summary of the user's playlists and their tracks to provide context to the AI."""
+    context, _ = await _build_playlists_context(request, limit_tracks)
+    return context
+
+
+async def _build_playlists_context(request: Request, limit_tracks: int = 10) -> tuple[str, bool]:
+    """The playlists context and whether it is complete (nothing failed or was skipped)."""
     if not request:
-        return ""
+        return "", False
     
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
 
     if not access_token:
-        return ""
+        return "", False
 
     try:
         expires_at = float(expires_at_raw) if expires_at_raw else 0
@@ -629,9 +970,9 @@ def get_user_playlists_context(request: Request, limit_tracks: int = 10) -> str:
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
-            return ""
+            return "", False
         access_token = token_data.get("access_token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
@@ -640,40 +981,46 @@ def get_user_playlists_context(request: Request, limit_tracks: int = 10) -> str:
     context_lines = ["User's existing Spotify Playlists:"]
     
     playlists = []
+    complete = True
     while playlists_url:
         try:
-            req = urllib.request.Request(playlists_url, headers=headers, method="GET")
-            with urllib.request.urlopen(req, timeout=5) as resp:
-                data = json.loads(resp.read().decode("utf-8"))
-                playlists.extend(data.get("items", []))
-                playlists_url = data.get("next")
+            data = await _spotify_json_request(playlists_url, headers, timeout=5)
+            playlists.extend(data.get("items", []))
+            playlists_url = data.get("next")
         except Exception as e:
             print(f"Failed to fetch user playlists for context: {e}")
+            complete = False
             break
         
     if not playlists:
-        return "The user currently has no playlists on Spotify."
+        if not complete:
+            return "", False
+        return "The user currently has no playlists on Spotify.", True
+
+    # Fetch each playlist's tracks concurrently. Anything still running when the
+    # budget runs out is cancelled and left out of the context.
+    semaphore = asyncio.Semaphore(PLAYLIST_CONTEXT_CONCURRENCY)
 
-    for p in playlists:
-        if not p: continue
+    async def describe_playlist(p: dict) -> tuple[str, bool]:
         p_name = p.get("name")
         p_id = p.get("id")
-        
+
         p_image = ""
         images = p.get("images", [])
         if images and len(images) > 0:
             p_image = images[0].get("url", "")
-        
+
         tracks_url = f"{API_BASE_URL}/playlists/{p_id}/tracks?limit={limit_tracks}"
         try:
-            treq = urllib.request.Request(tracks_url, headers=headers, method="GET")
-            with urllib.request.urlopen(treq, timeout=5) as tresp:
-                tdata = json.loads(tresp.read().decode("utf-8"))
-                track_items = tdata.get("items", [])
+            async with semaphore:
+                tdata = await _spotify_json_request(tracks_url, headers, timeout=5)
+            track_items = tdata.get("items", [])
+            fetched = True
         except Exception as e:
             print(f"Failed to fetch tracks for playlist {p_name}: {e}")
             track_items = []
-            
+            fetched = False
+
         track_names = []
         for item in track_items:
             track_obj = item.get("track")
@@ -681,25 +1028,44 @@ def get_user_playlists_context(request: Request, limit_tracks: int = 10) -> str:
                 t_name = track_obj.get("name")
                 artists = ", ".join([a.get("name") for a in track_obj.get("artists", []) if a.get("name")])
                 track_names.append(f"'{t_name}' by {artists}")
-                
+
         if track_names:
-            context_lines.append(f"- Playlist '{p_name}' (ID: {p_id}, Image: {p_image}): {', '.join(track_names)}")
-        else:
-            context_lines.append(f"- Playlist '{p_name}' (ID: {p_id}, Image: {p_image}): (no tracks or unable to fetch)")
+            return f"- Playlist '{p_name}' (ID: {p_id}, Image: {p_image}): {', '.join(track_names)}", fetched
+        return f"- Playlist '{p_name}' (ID: {p_id}, Image: {p_image}): (no tracks or unable to fetch)", fetched
+
+    tasks = [asyncio.create_task(describe_playlist(p)) for p in playlists if p]
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=PLAYLIST_CONTEXT_BUDGET_SECONDS)
+        for task in pending:
+            task.cancel()
+        if pending:
+            print(f"Playlist context budget exceeded; skipped {len(pending)} of {len(tasks)} playlists")
+            complete = False
+        for task in tasks:
+            if task in done:
+                line, fetched = task.result()
+                context_lines.append(line)
+                complete = complete and fetched
+
+    return "\n".join(context_lines), complete
+
+async def get_user_top_tastes_context(request: Request) -> str:
+    """Fetch a brief summary of the user's top artists, genres, and tracks to provide context to the AI."""
+    context, _ = await _build_top_tastes_context(request)
+    return context
 
-    return "\n".join(context_lines)
 
-def get_user_top_tastes_context(request: Request) -> str:
-    """Fetch a brief summary of the user's top artists, genres, and tracks to provide context to the AI."""
+async def _build_top_tastes_context(request: Request) -> tuple[str, bool]:
+    """The top tastes context and whether both fetches succeeded."""
     if not request:
-        return ""
+        return "", False
     
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
 
     if not access_token:
-        return ""
+        return "", False
 
     try:
         expires_at = float(expires_at_raw) if expires_at_raw else 0
@@ -707,63 +1073,112 @@ def get_user_top_tastes_context(request: Request) -> str:
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
-            return ""
+            return "", False
         access_token = token_data.get("access_token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     
     context_lines = []
+    complete = True
     
     # 1. Fetch Top Artists & Genres
     artists_url = f"{API_BASE_URL}/me/top/artists?limit=15&time_range=medium_term"
     try:
-        req = urllib.request.Request(artists_url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            artists_items = data.get("items", [])
-            
-            top_artists = []
-            all_genres = set()
-            for a in artists_items:
-                top_artists.append(a.get("name"))
-                for g in a.get("genres", []):
-                    all_genres.add(g)
-            
-            if top_artists:
-                context_lines.append(f"User's Top Artists: {', '.join(top_artists)}")
-            if all_genres:
-                context_lines.append(f"User's Top Genres: {', '.join(list(all_genres)[:15])}")
+        data = await _spotify_json_request(artists_url, headers, timeout=5)
+        artists_items = data.get("items", [])
+        
+        top_artists = []
+        all_genres = set()
+        for a in artists_items:
+            top_artists.append(a.get("name"))
+            for g in a.get("genres", []):
+                all_genres.add(g)
+        
+        if top_artists:
+            context_lines.append(f"User's Top Artists: {', '.join(top_artists)}")
+        if all_genres:
+            context_lines.append(f"User's Top Genres: {', '.join(list(all_genres)[:15])}")
     except Exception as e:
         print(f"Failed to fetch top artists for context: {e}")
+        complete = False
 
     # 2. Fetch Top Tracks
     tracks_url = f"{API_BASE_URL}/me/top/tracks?limit=10&time_range=medium_term"
     try:
-        req = urllib.request.Request(tracks_url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=5) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-            tracks_items = data.get("items", [])
-            
-            top_tracks = []
-            for t in tracks_items:
-                t_name = t.get("name")
-                artists = ", ".join([a.get("name") for a in t.get("artists", []) if a.get("name")])
-                top_tracks.append(f"'{t_name}' by {artists}")
-            
-            if top_tracks:
-                context_lines.append(f"User's Top Tracks: {', '.join(top_tracks)}")
+        data = await _spotify_json_request(tracks_url, headers, timeout=5)
+        tracks_items = data.get("items", [])
+        
+        top_tracks = []
+        for t in tracks_items:
+            t_name = t.get("name")
+            artists = ", ".join([a.get("name") for a in t.get("artists", []) if a.get("name")])
+            top_tracks.append(f"'{t_name}' by {artists}")
+        
+        if top_tracks:
+            context_lines.append(f"User's Top Tracks: {', '.join(top_tracks)}")
     except Exception as e:
         print(f"Failed to fetch top tracks for context: {e}")
+        complete = False
 
     if not context_lines:
-        return ""
+        return "", complete
         
-    return "\n" + "\n".join(context_lines)
+    return "\n" + "\n".join(context_lines), complete
+
+
+def _ai_context_key(user_id: str) -> str:
+    return f"ai_context:{user_id}"
+
 
+async def get_user_ai_context(request: Request) -> tuple[str, str]:
+    """Return (playlist_context, tastes_context), cached per Spotify user in Redis."""
+    try:
+        user_id = await get_current_user_id(request)
+    except HTTPException:
+        user_id = None
+
+    if user_id:
+        try:
+            cached = await r.get(_ai_context_key(user_id))
+            if cached:
+                data = json.loads(cached)
+                return data["playlists"], data["tastes"]
+        except Exception as e:
+            print(f"Failed to read AI context cache: {e}")
+
+    (playlist_context, playlists_complete), (tastes_context, tastes_complete) = await asyncio.gather(
+        _build_playlists_context(request),
+        _build_top_tastes_context(request),
+    )
 
-def _get_spotify_user_access_token(request: Request) -> str | None:
+    if user_id:
+        try:
+            # A partial context is only reused briefly, so the next turn soon tries again
+            await r.set(
+                _ai_context_key(user_id),
+                json.dumps({"playlists": playlist_context, "tastes": tastes_context}),
+                ex=AI_CONTEXT_TTL if playlists_complete and tastes_complete else AI_CONTEXT_PARTIAL_TTL,
+            )
+        except Exception as e:
+            print(f"Failed to write AI context cache: {e}")
+
+    return playlist_context, tastes_context
+
+
+async def invalidate_user_ai_context(access_token: str, user_id: str | None = None):
+    """Drop the cached AI context after one of our own writes changed the user's playlists."""
+    try:
+        if not user_id:
+            user_id = await lookup_user_id(access_token)
+        if user_id:
+            await r.delete(_ai_context_key(user_id))
+    except Exception as e:
+        print(f"Failed to invalidate AI context cache: {e}")
+
+
+async def _get_spotify_user_access_token(request: Request) -> str | None:
     if not request:
         return None
 
@@ -780,7 +1195,7 @@ def _get_spotify_user_access_token(request: Request) -> str | None:
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             return None
         access_token = token_data.get("access_token")
@@ -788,12 +1203,12 @@ def _get_spotify_user_access_token(request: Request) -> str | None:
     return access_token
 
 
-def get_user_top_artists_data(
+async def get_user_top_artists_data(
     request: Request,
     time_range: str = "medium_term",
     limit: int = 10,
 ) -> list[dict]:
-    access_token = _get_spotify_user_access_token(request)
+    access_token = await _get_spotify_user_access_token(request)
     if not access_token:
         return []
 
@@ -802,9 +1217,7 @@ def get_user_top_artists_data(
     url = f"{API_BASE_URL}/me/top/artists?{urllib.parse.urlencode(params)}"
 
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        data = await _spotify_json_request(url, headers)
     except Exception as e:
         print(f"Failed to fetch top artists data: {e}")
         return []
@@ -822,12 +1235,12 @@ def get_user_top_artists_data(
     return artists
 
 
-def get_user_top_tracks_data(
+async def get_user_top_tracks_data(
     request: Request,
     time_range: str = "medium_term",
     limit: int = 10,
 ) -> list[dict]:
-    access_token = _get_spotify_user_access_token(request)
+    access_token = await _get_spotify_user_access_token(request)
     if not access_token:
         return []
 
@@ -836,9 +1249,7 @@ def get_user_top_tracks_data(
     url = f"{API_BASE_URL}/me/top/tracks?{urllib.parse.urlencode(params)}"
 
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
+        data = await _spotify_json_request(url, headers)
     except Exception as e:
         print(f"Failed to fetch top tracks data: {e}")
         return []
@@ -856,13 +1267,13 @@ def get_user_top_tracks_data(
     return tracks
 
 
-def get_user_top_genres_data(
+async def get_user_top_genres_data(
     request: Request,
     time_range: str = "medium_term",
     artist_limit: int = 20,
     genre_limit: int = 10,
 ) -> list[dict]:
-    artists = get_user_top_artists_data(
+    artists = await get_user_top_artists_data(
         request=request,
         time_range=time_range,
         limit=artist_limit,
@@ -886,24 +1297,24 @@ def get_user_top_genres_data(
     ]
 
 
-def get_user_taste_profile_data(
+async def get_user_taste_profile_data(
     request: Request,
     time_range: str = "medium_term",
     artist_limit: int = 10,
     track_limit: int = 10,
     genre_limit: int = 10,
 ) -> dict:
-    artists = get_user_top_artists_data(
+    artists = await get_user_top_artists_data(
         request=request,
         time_range=time_range,
         limit=artist_limit,
     )
-    tracks = get_user_top_tracks_data(
+    tracks = await get_user_top_tracks_data(
         request=request,
         time_range=time_range,
         limit=track_limit,
     )
-    genres = get_user_top_genres_data(
+    genres = await get_user_top_genres_data(
         request=request,
         time_range=time_range,
         artist_limit=max(artist_limit, genre_limit),
@@ -917,7 +1328,7 @@ def get_user_taste_profile_data(
         "top_genres": genres,
     }
 
-def create_playlist(
+async def create_playlist(
     name: str,
     description: str | None = None,
     public: bool = False,
@@ -939,19 +1350,16 @@ def create_playlist(
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Token refresh failed")
         access_token = token_data.get("access_token")
+        expires_at = token_data.get("expires_at")
 
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    user_url = f"{API_BASE_URL}/me"
     try:
-        req = urllib.request.Request(user_url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            user_data = json.loads(resp.read().decode("utf-8"))
-            user_id = user_data.get("id")
-    except urllib.error.HTTPError as he:
+        user_id = await lookup_user_id(access_token, expires_at)
+    except SpotifyHTTPError as he:
         if he.code == 401:
             raise HTTPException(status_code=401, detail="Not authenticated")
         raise HTTPException(status_code=502, detail=f"Failed to get user ID: {he}")
@@ -964,43 +1372,53 @@ def create_playlist(
         "collaborative": False,
     }
     try:
-        data_bytes = json.dumps(payload).encode("utf-8")
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        new_playlist = await _spotify_json_request(url, headers, method="POST", payload=payload)
+    except SpotifyHTTPError as he:
         if he.code == 401:
             raise HTTPException(status_code=401, detail="Not authenticated")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token, user_id)
+    return new_playlist
 
 
-def search_spotify_songs(
+async def search_spotify_songs(
     query: str,
     type: str = "track",
     limit: int = 1,
+    market: str | None = None,
 ):
-    """Search Spotify (uses app token, no user auth)."""
-    access_token = get_app_token()
+    """Search Spotify (uses app token, no user auth). Results are shared through the search cache."""
+    cached = await search_cache.get(query, type, limit, market)
+    if cached is not None:
+        return cached
+
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"q": query, "type": type, "limit": limit}
+    if market:
+        params["market"] = market
     url = f"{API_BASE_URL}/search?{urllib.parse.urlencode(params)}"
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
+    await search_cache.put(query, type, limit, market, data)
+    return data
+
 
-def add_tracks_to_playlist(
+async def add_tracks_to_playlist(
     playlist_id: str,
     track_ids: list[str],
     request: Request | None = None,
 ):
-    """Add tracks to a playlist. Requires request for cookies (access_token)."""
+    """Add tracks to a playlist, 100 per call, in order. Requires request for cookies (access_token).
+
+    Returns the write_playlist_tracks result; check `written` against `total` for partial failures.
+    """
     if not request:
         raise HTTPException(status_code=401, detail="Request required for authentication")
     access_token = request.cookies.get("access_token")
@@ -1016,27 +1434,25 @@ def add_tracks_to_playlist(
         expires_at = 0
 
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Token refresh failed")
         access_token = token_data.get("access_token")
 
     uris = [f"spotify:track:{tid}" for tid in track_ids]
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
-    url = f"{API_BASE_URL}/playlists/{playlist_id}/tracks"
     try:
-        data_bytes = json.dumps({"uris": uris}).encode("utf-8")
-        req = urllib.request.Request(url, data=data_bytes, headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await write_playlist_tracks(playlist_id, uris, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401:
             raise HTTPException(status_code=401, detail="Not authenticated")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+    await invalidate_user_ai_context(access_token)
+    return data
 
 
 @router.get("/me")
-def get_me(request: Request):
+async def get_me(request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1051,7 +1467,7 @@ def get_me(request: Request):
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
              raise HTTPException(status_code=401, detail="Session expired")
         
@@ -1063,10 +1479,8 @@ def get_me(request: Request):
     url = f"{API_BASE_URL}/me"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
@@ -1086,7 +1500,7 @@ def get_me(request: Request):
     return resp
 
 @router.get("/top-artists")
-def get_top_artists(request: Request, time_range: str = "medium_term", limit: int = 20):
+async def get_top_artists(request: Request, time_range: str = "medium_term", limit: int = 20):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1101,7 +1515,7 @@ def get_top_artists(request: Request, time_range: str = "medium_term", limit: in
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Session expired")
         
@@ -1114,10 +1528,8 @@ def get_top_artists(request: Request, time_range: str = "medium_term", limit: in
     url = f"{API_BASE_URL}/me/top/artists?{urllib.parse.urlencode(params)}"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
@@ -1139,7 +1551,7 @@ def get_top_artists(request: Request, time_range: str = "medium_term", limit: in
     return resp
 
 @router.get("/top-tracks")
-def get_top_tracks(request: Request, time_range: str = "medium_term", limit: int = 20):
+async def get_top_tracks(request: Request, time_range: str = "medium_term", limit: int = 20):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1154,7 +1566,7 @@ def get_top_tracks(request: Request, time_range: str = "medium_term", limit: int
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Session expired")
         
@@ -1167,10 +1579,8 @@ def get_top_tracks(request: Request, time_range: str = "medium_term", limit: int
     url = f"{API_BASE_URL}/me/top/tracks?{urllib.parse.urlencode(params)}"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
@@ -1196,7 +1606,7 @@ def get_top_tracks(request: Request, time_range: str = "medium_term", limit: int
     return resp
 
 @router.get("/recently-played")
-def get_recently_played(request: Request, limit: int = 10):
+async def get_recently_played(request: Request, limit: int = 10):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1209,7 +1619,7 @@ def get_recently_played(request: Request, limit: int = 10):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -1220,10 +1630,8 @@ def get_recently_played(request: Request, limit: int = 10):
     url = f"{API_BASE_URL}/me/player/recently-played?{urllib.parse.urlencode(params)}"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 403: raise HTTPException(status_code=403, detail="Missing permissions.")
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
@@ -1253,7 +1661,7 @@ def get_recently_played(request: Request, limit: int = 10):
     return {"items": formatted_items}
 
 @router.get("/currently-playing")
-def get_currently_playing(request: Request):
+async def get_currently_playing(request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1266,7 +1674,7 @@ def get_currently_playing(request: Request):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -1279,27 +1687,11 @@ def get_currently_playing(request: Request):
     
     data = None
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            # 204 No Content means nothing is playing
-            if resp.status == 204:
-                data = None
-            else:
-                body_text = resp.read().decode("utf-8")
-                # Sometimes body might be empty even if 200? Spotify is quirky.
-                if body_text:
-                    data = json.loads(body_text)
-                else:
-                    data = None
-
-    except urllib.error.HTTPError as he:
+        # 204 No Content (nothing playing) and empty 200 bodies both come back as None
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
-        # 204 might come as error in some libs, but urllib usually handles status above.
-        # Just in case:
-        if he.code == 204: 
-             data = None
-        else:
-             raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+        raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
     # Build response
     resp_obj = {"is_playing": False, "item": None}
@@ -1336,7 +1728,7 @@ def get_currently_playing(request: Request):
 
 # --- Player Controls ---
 
-def _proxy_player_request(request: Request, method: str, endpoint: str):
+async def _proxy_player_request(request: Request, method: str, endpoint: str):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1349,7 +1741,7 @@ def _proxy_player_request(request: Request, method: str, endpoint: str):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -1359,22 +1751,21 @@ def _proxy_player_request(request: Request, method: str, endpoint: str):
     url = f"{API_BASE_URL}/me/player/{endpoint}"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method=method)
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            # 204 No Content is expected for these calls
-            pass
-    except urllib.error.HTTPError as he:
+        # 204 No Content is expected for these calls
+        await spotify_client.request(method, url, headers=headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         # 403 usually means premium required or scope missing, or no active device
         raise HTTPException(status_code=he.code, detail=f"Spotify Error: {he}")
 
+    resp = JSONResponse({"message": "Player command sent"})
     if new_cookie_needed:
         resp.set_cookie("access_token", access_token, httponly=True, samesite="lax")
         resp.set_cookie("expires_at", str(int(expires_at)), httponly=True, samesite="lax")
     return resp
 
 @router.get("/player/queue")
-def get_queue(request: Request):
+async def get_queue(request: Request):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1387,7 +1778,7 @@ def get_queue(request: Request):
     new_cookie_needed = False
     
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data: return RedirectResponse(url="/api/auth/login")
         access_token = token_data.get("access_token")
         expires_at = datetime.now().timestamp() + (token_data.get("expires_in") or 0)
@@ -1397,10 +1788,8 @@ def get_queue(request: Request):
     url = f"{API_BASE_URL}/me/player/queue"
     
     try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         if he.code == 401: return RedirectResponse(url="/api/auth/login")
         # 403 Forbidden might happen if scope is missing (user needs to re-login)
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
@@ -1414,39 +1803,25 @@ def get_queue(request: Request):
     return data
 
 @router.put("/player/play")
-def play_playback(request: Request):
-    return _proxy_player_request(request, "PUT", "play")
+async def play_playback(request: Request):
+    return await _proxy_player_request(request, "PUT", "play")
 
 @router.put("/player/pause")
-def pause_playback(request: Request):
-    return _proxy_player_request(request, "PUT", "pause")
+async def pause_playback(request: Request):
+    return await _proxy_player_request(request, "PUT", "pause")
 
 @router.post("/player/next")
-def next_track(request: Request):
-    return _proxy_player_request(request, "POST", "next")
+async def next_track(request: Request):
+    return await _proxy_player_request(request, "POST", "next")
 
 @router.post("/player/previous")
-def previous_track(request: Request):
-    return _proxy_player_request(request, "POST", "previous")
+async def previous_track(request: Request):
+    return await _proxy_player_request(request, "POST", "previous")
 
 @router.get("/search")
-def search_spotify(request: Request, q: str, type: str = "track", limit: int = 20):
-    # Use App Token (Public Search)
-    access_token = get_app_token()
-    if not access_token: 
-        raise HTTPException(status_code=500, detail="Failed to get app token")
-
-    headers = {"Authorization": f"Bearer {access_token}"}
-    params = {"q": q, "type": type, "limit": limit}
-    url = f"{API_BASE_URL}/search?{urllib.parse.urlencode(params)}"
-    
-    # ... standard request ...
-    try:
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            data = json.loads(resp.read().decode("utf-8"))
-    except urllib.error.HTTPError as he:
-        raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
+async def search_spotify(request: Request, q: str, type: str = "track", limit: int = 20, market: str | None = None):
+    # Use App Token (Public Search), through the shared search cache
+    data = await search_spotify_songs(query=q, type=type, limit=limit, market=market)
 
     # Return raw structure or format it. For search, raw is often versatile enough for the frontend
     # but let's format slightly to match our other endpoints if necessary.
@@ -1455,8 +1830,17 @@ def search_spotify(request: Request, q: str, type: str = "track", limit: int = 2
     return data
 
 
+@router.get("/search/cache-stats")
+async def search_cache_stats():
+    """Hit/miss counters and size of the shared search cache."""
+    try:
+        return await search_cache.stats()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Search cache unavailable: {e}")
+
+
 @router.get("/recommendations")
-def get_recommendations(request: Request, limit: int = 12):
+async def get_recommendations(request: Request, limit: int = 12):
     access_token = request.cookies.get("access_token")
     refresh_token = request.cookies.get("refresh_token")
     expires_at_raw = request.cookies.get("expires_at")
@@ -1471,7 +1855,7 @@ def get_recommendations(request: Request, limit: int = 12):
 
     new_cookie_needed = False
     if datetime.now().timestamp() > expires_at:
-        token_data = handle_token_refresh(refresh_token)
+        token_data = await refresh_user_token(request, refresh_token)
         if not token_data:
             raise HTTPException(status_code=401, detail="Session expired")
         access_token = token_data.get("access_token")
@@ -1480,10 +1864,8 @@ def get_recommendations(request: Request, limit: int = 12):
 
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    def fetch_json(url: str):
-        req = urllib.request.Request(url, headers=headers, method="GET")
-        with urllib.request.urlopen(req, timeout=10) as resp:
-            return json.loads(resp.read().decode("utf-8"))
+    async def fetch_json(url: str):
+        return await _spotify_json_request(url, headers)
 
     def normalize_name(value: str | None) -> str:
         return (value or "").strip().lower()
@@ -1493,24 +1875,32 @@ def get_recommendations(request: Request, limit: int = 12):
             return None
         return sum(values) / len(values)
 
-    def fetch_audio_features(track_ids: list[str]) -> dict[str, dict]:
-        unique_ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id]
-        features_by_id: dict[str, dict] = {}
-        for start in range(0, len(unique_ids), 100):
-            batch = unique_ids[start:start + 100]
-            if not batch:
-                continue
-            try:
-                data = fetch_json(
-                    f"{API_BASE_URL}/audio-features?{urllib.parse.urlencode({'ids': ','.join(batch)})}"
-                )
-            except Exception as exc:
-                print(f"Failed to fetch audio features for recommendations: {exc}")
-                continue
-            for feature in data.get("audio_features", []) if data else []:
-                if feature and feature.get("id"):
-                    features_by_id[feature["id"]] = feature
-        return features_by_id
+    async def fetch_recent_tracks() -> list[dict]:
+        try:
+            recent_data = await fetch_json(f"{API_BASE_URL}/me/player/recently-played?limit=10")
+        except Exception as exc:
+            print(f"Failed to fetch recent tracks for recommendations: {exc}")
+            return []
+        return [
+            item.get("track", {})
+            for item in recent_data.get("items", [])
+            if item.get("track", {}).get("id")
+        ]
+
+    async def fetch_available_genres() -> set[str]:
+        app_token = await get_app_token()
+        if not app_token:
+            return set()
+        try:
+            app_headers = {"Authorization": f"Bearer {app_token}"}
+            genres_data = await _spotify_json_request(
+                f"{API_BASE_URL}/recommendations/available-genre-seeds",
+                app_headers,
+            )
+        except Exception as exc:
+            print(f"Failed to fetch available genre seeds for recommendations: {exc}")
+            return set()
+        return set((genres_data or {}).get("genres", []))
 
     def extract_seed_genres(artists: list[dict], available_genres: set[str], limit_count: int = 5) -> list[str]:
         genre_counter: Counter[str] = Counter()
@@ -1522,26 +1912,16 @@ def get_recommendations(request: Request, limit: int = 12):
         return [genre for genre, _ in genre_counter.most_common(limit_count)]
 
     try:
-        top_artists_by_range = {
-            "short_term": get_user_top_artists_data(request, "short_term", 8),
-            "medium_term": get_user_top_artists_data(request, "medium_term", 8),
-            "long_term": get_user_top_artists_data(request, "long_term", 8),
-        }
-        top_tracks_by_range = {
-            "short_term": get_user_top_tracks_data(request, "short_term", 8),
-            "medium_term": get_user_top_tracks_data(request, "medium_term", 8),
-            "long_term": get_user_top_tracks_data(request, "long_term", 8),
-        }
-        recent_tracks: list[dict] = []
-        try:
-            recent_data = fetch_json(f"{API_BASE_URL}/me/player/recently-played?limit=10")
-            recent_tracks = [
-                item.get("track", {})
-                for item in recent_data.get("items", [])
-                if item.get("track", {}).get("id")
-            ]
-        except Exception as exc:
-            print(f"Failed to fetch recent tracks for recommendations: {exc}")
+        # Everything the seed selection needs is independent, so fetch it in one bounded fan-out.
+        time_ranges = ("short_term", "medium_term", "long_term")
+        *top_results, recent_tracks, available_genres = await spotify_client.gather_limited(
+            *(get_user_top_artists_data(request, time_range, 8) for time_range in time_ranges),
+            *(get_user_top_tracks_data(request, time_range, 8) for time_range in time_ranges),
+            fetch_recent_tracks(),
+            fetch_available_genres(),
+        )
+        top_artists_by_range = dict(zip(time_ranges, top_results[:3]))
+        top_tracks_by_range = dict(zip(time_ranges, top_results[3:]))
 
         all_top_artists = [
             artist
@@ -1559,19 +1939,6 @@ def get_recommendations(request: Request, limit: int = 12):
         if not all_top_tracks and not all_top_artists and not recent_tracks:
             raise HTTPException(status_code=404, detail="Not enough listening history for recommendations")
 
-        app_token = get_app_token()
-        available_genres: set[str] = set()
-        if app_token:
-            try:
-                app_headers = {"Authorization": f"Bearer {app_token}"}
-                genres_data = _spotify_json_request(
-                    f"{API_BASE_URL}/recommendations/available-genre-seeds",
-                    app_headers,
-                )
-                available_genres = set((genres_data or {}).get("genres", []))
-            except Exception as exc:
-                print(f"Failed to fetch available genre seeds for recommendations: {exc}")
-
         weighted_track_ids: list[str] = []
         weighted_artist_ids: list[str] = []
         for time_range, multiplier in (("short_term", 3), ("medium_term", 2), ("long_term", 1)):
@@ -1610,7 +1977,7 @@ def get_recommendations(request: Request, limit: int = 12):
         profile_track_ids.extend([track["id"] for track in top_tracks_by_range["medium_term"][:5]])
         profile_track_ids.extend([track["id"] for track in top_tracks_by_range["long_term"][:5]])
         profile_track_ids.extend([track.get("id") for track in recent_tracks[:5] if track.get("id")])
-        features_by_id = fetch_audio_features(profile_track_ids)
+        features_by_id = await fetch_audio_features(profile_track_ids)
 
         feature_fields = [
             "danceability",
@@ -1648,8 +2015,8 @@ def get_recommendations(request: Request, limit: int = 12):
         for field, value in target_audio_profile.items():
             params[f"target_{field}"] = value
 
-        recs_data = fetch_json(f"{API_BASE_URL}/recommendations?{urllib.parse.urlencode(params)}")
-    except urllib.error.HTTPError as he:
+        recs_data = await fetch_json(f"{API_BASE_URL}/recommendations?{urllib.parse.urlencode(params)}")
+    except SpotifyHTTPError as he:
         if he.code == 401:
             raise HTTPException(status_code=401, detail="Spotify token invalid or expired.")
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
@@ -1681,7 +2048,9 @@ def get_recommendations(request: Request, limit: int = 12):
     }
 
     candidate_tracks = recs_data.get("tracks", []) if recs_data else []
-    candidate_features = fetch_audio_features([track.get("id") for track in candidate_tracks if track.get("id")])
+    candidate_features = await fetch_audio_features(
+        [track.get("id") for track in candidate_tracks if track.get("id")]
+    )
     seen_signatures: set[tuple[str, tuple[str, ...]]] = set()
     scored_tracks: list[tuple[float, dict]] = []
 
@@ -1783,89 +2152,125 @@ def get_recommendations(request: Request, limit: int = 12):
     return payload
 
 
-@router.get("/audio-features")
-def get_audio_features(request: Request, ids: str):
-    access_token = get_app_token()
+# --- Batched ID lookups ---
+# Per-process loaders: IDs asked for by concurrent requests within a few
+# milliseconds go upstream as one batched call (app token, so any caller can share it).
+
+async def _fetch_several(path: str, result_key: str, ids: list[str]) -> dict[str, dict]:
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
-
     headers = {"Authorization": f"Bearer {access_token}"}
-    url = f"{API_BASE_URL}/audio-features?{urllib.parse.urlencode({'ids': ids})}"
+    data = await _spotify_json_request(f"{API_BASE_URL}/{path}?{urllib.parse.urlencode({'ids': ','.join(ids)})}", headers)
+    return {item["id"]: item for item in (data or {}).get(result_key, []) if item and item.get("id")}
+
+
+async def _load_audio_features_batch(track_ids: list[str]) -> dict[str, dict]:
+    features_by_id = await _fetch_several("audio-features", "audio_features", track_ids)
+    await audio_features_store.save(list(features_by_id.values()))
+    return features_by_id
+
+
+audio_features_loader = spotify_client.BatchLoader(_load_audio_features_batch, max_batch_size=100)
+
+
+async def fetch_audio_features(track_ids: list[str], strict: bool = False) -> dict[str, dict]:
+    """Audio features by track ID: read the local store first, send only the misses to the batch loader.
+
+    Upstream failures are logged and the store hits returned, unless `strict` is set.
+    """
+    unique_ids = [track_id for track_id in dict.fromkeys(track_ids) if track_id]
+    features_by_id = await audio_features_store.load(unique_ids)
+    misses = [track_id for track_id in unique_ids if track_id not in features_by_id]
+    if misses:
+        try:
+            features_by_id.update(await audio_features_loader.load_many(misses))
+        except Exception as e:
+            if strict:
+                raise
+            print(f"Failed to fetch audio features: {e}")
+    return features_by_id
+
+
+@router.get("/audio-features")
+async def get_audio_features(request: Request, ids: str):
+    track_ids = [track_id.strip() for track_id in ids.split(",") if track_id.strip()]
     try:
-        data = _spotify_json_request(url, headers)
-    except urllib.error.HTTPError as he:
+        features_by_id = await fetch_audio_features(track_ids, strict=True)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
 
-    return {"audio_features": data.get("audio_features", []) if data else []}
+    # Same shape as Spotify: one entry per requested ID, null where none exists
+    return {"audio_features": [features_by_id.get(track_id) for track_id in track_ids]}
 
 
 @router.get("/artists/{artist_id}/related-artists")
-def get_related_artists(artist_id: str):
-    access_token = get_app_token()
+async def get_related_artists(artist_id: str):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     url = f"{API_BASE_URL}/artists/{artist_id}/related-artists"
     try:
-        data = _spotify_json_request(url, headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     return {"artists": data.get("artists", []) if data else []}
 
 
 @router.get("/artists/{artist_id}/top-tracks")
-def get_artist_top_tracks(artist_id: str, market: str = "US"):
-    access_token = get_app_token()
+async def get_artist_top_tracks(artist_id: str, market: str = "US"):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     url = f"{API_BASE_URL}/artists/{artist_id}/top-tracks?{urllib.parse.urlencode({'market': market})}"
     try:
-        data = _spotify_json_request(url, headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(url, headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     return {"tracks": data.get("tracks", []) if data else []}
 
 
 @router.get("/albums/{album_id}")
-def get_album(album_id: str):
-    access_token = get_app_token()
+async def get_album(album_id: str):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/albums/{album_id}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/albums/{album_id}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     return data or {}
 
 
 @router.get("/albums/{album_id}/tracks")
-def get_album_tracks(album_id: str, limit: int = 50, offset: int = 0):
-    access_token = get_app_token()
+async def get_album_tracks(album_id: str, limit: int = 50, offset: int = 0):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
 
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/albums/{album_id}/tracks?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/albums/{album_id}/tracks?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     return {"items": data.get("items", []) if data else [], "total": data.get("total", 0) if data else 0}
 
 
 @router.get("/me/tracks")
-def get_saved_tracks(request: Request, limit: int = 20, offset: int = 0):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def get_saved_tracks(request: Request, limit: int = 20, offset: int = 0):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/me/tracks?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/me/tracks?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"items": data.get("items", []) if data else [], "total": data.get("total", 0) if data else 0}
     if new_cookie_needed:
@@ -1877,12 +2282,12 @@ def get_saved_tracks(request: Request, limit: int = 20, offset: int = 0):
 
 
 @router.put("/me/tracks")
-def save_tracks(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def save_tracks(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/tracks", headers, method="PUT", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/tracks", headers, method="PUT", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Tracks saved"}
     if new_cookie_needed:
@@ -1894,12 +2299,12 @@ def save_tracks(request: Request, body: SaveIdsRequest):
 
 
 @router.delete("/me/tracks")
-def remove_saved_tracks(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def remove_saved_tracks(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/tracks", headers, method="DELETE", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/tracks", headers, method="DELETE", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Tracks removed"}
     if new_cookie_needed:
@@ -1911,13 +2316,13 @@ def remove_saved_tracks(request: Request, body: SaveIdsRequest):
 
 
 @router.get("/me/albums")
-def get_saved_albums(request: Request, limit: int = 20, offset: int = 0):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def get_saved_albums(request: Request, limit: int = 20, offset: int = 0):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/me/albums?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/me/albums?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"items": data.get("items", []) if data else [], "total": data.get("total", 0) if data else 0}
     if new_cookie_needed:
@@ -1929,12 +2334,12 @@ def get_saved_albums(request: Request, limit: int = 20, offset: int = 0):
 
 
 @router.put("/me/albums")
-def save_albums(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def save_albums(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/albums", headers, method="PUT", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/albums", headers, method="PUT", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Albums saved"}
     if new_cookie_needed:
@@ -1946,12 +2351,12 @@ def save_albums(request: Request, body: SaveIdsRequest):
 
 
 @router.delete("/me/albums")
-def remove_saved_albums(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def remove_saved_albums(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/albums", headers, method="DELETE", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/albums", headers, method="DELETE", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Albums removed"}
     if new_cookie_needed:
@@ -1963,15 +2368,15 @@ def remove_saved_albums(request: Request, body: SaveIdsRequest):
 
 
 @router.get("/me/following")
-def get_followed_artists(request: Request, limit: int = 20, after: str | None = None):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def get_followed_artists(request: Request, limit: int = 20, after: str | None = None):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"type": "artist", "limit": limit}
     if after:
         params["after"] = after
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/me/following?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/me/following?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     artists_payload = (data or {}).get("artists", {})
     payload = {"artists": artists_payload.get("items", []), "cursors": artists_payload.get("cursors", {})}
@@ -1984,13 +2389,13 @@ def get_followed_artists(request: Request, limit: int = 20, after: str | None =
 
 
 @router.put("/me/following")
-def follow_artists(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def follow_artists(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     params = urllib.parse.urlencode({"type": "artist"})
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/following?{params}", headers, method="PUT", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/following?{params}", headers, method="PUT", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Artists followed"}
     if new_cookie_needed:
@@ -2002,13 +2407,13 @@ def follow_artists(request: Request, body: SaveIdsRequest):
 
 
 @router.delete("/me/following")
-def unfollow_artists(request: Request, body: SaveIdsRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def unfollow_artists(request: Request, body: SaveIdsRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     params = urllib.parse.urlencode({"type": "artist"})
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/following?{params}", headers, method="DELETE", payload={"ids": body.ids})
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/following?{params}", headers, method="DELETE", payload={"ids": body.ids})
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"message": "Artists unfollowed"}
     if new_cookie_needed:
@@ -2020,26 +2425,26 @@ def unfollow_artists(request: Request, body: SaveIdsRequest):
 
 
 @router.get("/recommendations/available-genre-seeds")
-def get_available_genre_seeds():
-    access_token = get_app_token()
+async def get_available_genre_seeds():
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/recommendations/available-genre-seeds", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/recommendations/available-genre-seeds", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     return {"genres": data.get("genres", []) if data else []}
 
 
 @router.put("/playlists/{playlist_id}")
-def update_playlist(playlist_id: str, request: Request, body: UpdatePlaylistRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def update_playlist(playlist_id: str, request: Request, body: UpdatePlaylistRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     payload = body.model_dump(exclude_none=True)
     try:
-        _spotify_json_request(f"{API_BASE_URL}/playlists/{playlist_id}", headers, method="PUT", payload=payload)
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/playlists/{playlist_id}", headers, method="PUT", payload=payload)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     response_payload = {"message": "Playlist updated"}
     if new_cookie_needed:
@@ -2051,15 +2456,13 @@ def update_playlist(playlist_id: str, request: Request, body: UpdatePlaylistRequ
 
 
 @router.put("/playlists/{playlist_id}/image")
-def set_playlist_image(playlist_id: str, request: Request, body: SetPlaylistImageRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def set_playlist_image(playlist_id: str, request: Request, body: SetPlaylistImageRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "image/jpeg"}
     try:
         raw = body.image_base64.encode("utf-8")
-        req = urllib.request.Request(f"{API_BASE_URL}/playlists/{playlist_id}/images", data=raw, headers=headers, method="PUT")
-        with urllib.request.urlopen(req, timeout=10):
-            pass
-    except urllib.error.HTTPError as he:
+        await spotify_client.request("PUT", f"{API_BASE_URL}/playlists/{playlist_id}/images", headers=headers, content=raw)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     response_payload = {"message": "Playlist image updated"}
     if new_cookie_needed:
@@ -2071,72 +2474,72 @@ def set_playlist_image(playlist_id: str, request: Request, body: SetPlaylistImag
 
 
 @router.get("/browse/categories")
-def get_categories(country: str = "US", limit: int = 20, offset: int = 0):
-    access_token = get_app_token()
+async def get_categories(country: str = "US", limit: int = 20, offset: int = 0):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"country": country, "limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/browse/categories?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/browse/categories?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     categories = (data or {}).get("categories", {})
     return {"items": categories.get("items", []), "total": categories.get("total", 0)}
 
 
 @router.get("/browse/featured-playlists")
-def get_featured_playlists(country: str = "US", limit: int = 20, offset: int = 0):
-    access_token = get_app_token()
+async def get_featured_playlists(country: str = "US", limit: int = 20, offset: int = 0):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"country": country, "limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/browse/featured-playlists?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/browse/featured-playlists?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     playlists = (data or {}).get("playlists", {})
     return {"message": (data or {}).get("message"), "items": playlists.get("items", []), "total": playlists.get("total", 0)}
 
 
 @router.get("/browse/categories/{category_id}/playlists")
-def get_category_playlists(category_id: str, country: str = "US", limit: int = 20, offset: int = 0):
-    access_token = get_app_token()
+async def get_category_playlists(category_id: str, country: str = "US", limit: int = 20, offset: int = 0):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"country": country, "limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/browse/categories/{category_id}/playlists?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/browse/categories/{category_id}/playlists?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     playlists = (data or {}).get("playlists", {})
     return {"items": playlists.get("items", []), "total": playlists.get("total", 0)}
 
 
 @router.get("/browse/new-releases")
-def get_new_releases(country: str = "US", limit: int = 20, offset: int = 0):
-    access_token = get_app_token()
+async def get_new_releases(country: str = "US", limit: int = 20, offset: int = 0):
+    access_token = await get_app_token()
     if not access_token:
         raise HTTPException(status_code=500, detail="Failed to get app token")
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"country": country, "limit": limit, "offset": offset}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/browse/new-releases?{urllib.parse.urlencode(params)}", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/browse/new-releases?{urllib.parse.urlencode(params)}", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     albums = (data or {}).get("albums", {})
     return {"items": albums.get("items", []), "total": albums.get("total", 0)}
 
 
 @router.get("/player/devices")
-def get_devices(request: Request):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def get_devices(request: Request):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}"}
     try:
-        data = _spotify_json_request(f"{API_BASE_URL}/me/player/devices", headers)
-    except urllib.error.HTTPError as he:
+        data = await _spotify_json_request(f"{API_BASE_URL}/me/player/devices", headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     payload = {"devices": data.get("devices", []) if data else []}
     if new_cookie_needed:
@@ -2148,13 +2551,13 @@ def get_devices(request: Request):
 
 
 @router.put("/player/transfer")
-def transfer_playback(request: Request, body: TransferPlaybackRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def transfer_playback(request: Request, body: TransferPlaybackRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     payload = {"device_ids": [body.device_id], "play": body.play}
     try:
-        _spotify_json_request(f"{API_BASE_URL}/me/player", headers, method="PUT", payload=payload)
-    except urllib.error.HTTPError as he:
+        await _spotify_json_request(f"{API_BASE_URL}/me/player", headers, method="PUT", payload=payload)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     response_payload = {"message": "Playback transferred"}
     if new_cookie_needed:
@@ -2166,17 +2569,15 @@ def transfer_playback(request: Request, body: TransferPlaybackRequest):
 
 
 @router.post("/player/queue/add")
-def add_to_queue(request: Request, body: AddToQueueRequest):
-    access_token, expires_at, new_cookie_needed = _get_valid_user_access_token(request)
+async def add_to_queue(request: Request, body: AddToQueueRequest):
+    access_token, expires_at, new_cookie_needed = await _get_valid_user_access_token(request)
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"uri": body.uri}
     if body.device_id:
         params["device_id"] = body.device_id
     try:
-        req = urllib.request.Request(f"{API_BASE_URL}/me/player/queue?{urllib.parse.urlencode(params)}", headers=headers, method="POST")
-        with urllib.request.urlopen(req, timeout=10):
-            pass
-    except urllib.error.HTTPError as he:
+        await spotify_client.request("POST", f"{API_BASE_URL}/me/player/queue?{urllib.parse.urlencode(params)}", headers=headers)
+    except SpotifyHTTPError as he:
         raise HTTPException(status_code=502, detail=f"Spotify Error: {he}")
     response_payload = {"message": "Added to queue"}
     if new_cookie_needed:
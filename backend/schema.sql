@@ -16,6 +16,12 @@ create table public.chat_messages (
   created_at timestamp with time zone default timezone('utc'::text, now()) not null
 );
 
+-- Indexes for keyset pagination: pages are read in (created_at, id) / (updated_at, id) order
+create index if not exists chat_messages_session_created_id_idx
+  on public.chat_messages (session_id, created_at, id);
+create index if not exists chat_sessions_user_updated_id_idx
+  on public.chat_sessions (user_id, updated_at, id);
+
 -- Enable Row Level Security (RLS)
 alter table public.chat_sessions enable row level security;
 alter table public.chat_messages enable row level security;
@@ -0,0 +1,68 @@
+from backend.redis_client import r
+import hashlib
+import json
+import os
+import time
+
+# Spotify search results shared by every worker. Gemini proposes the same popular
+# songs for many users, so most proposal searches can be answered from here.
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "86400"))
+# Least recently used entries are evicted beyond this many cached searches.
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "50000"))
+
+_PREFIX = "search_cache:"
+_LRU_KEY = "search_cache_lru"
+_STATS_KEY = "search_cache_stats"
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def _key(query: str, type: str, limit: int, market: str | None) -> str:
+    raw = "|".join([_normalize(query), type, str(limit), (market or "").upper()])
+    return _PREFIX + hashlib.sha1(raw.encode()).hexdigest()
+
+
+async def get(query: str, type: str, limit: int, market: str | None = None) -> dict | None:
+    key = _key(query, type, limit, market)
+    try:
+        raw = await r.get(key)
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.hincrby(_STATS_KEY, "hits" if raw else "misses", 1)
+            if raw:
+                pipe.zadd(_LRU_KEY, {key: time.time()})
+            await pipe.execute()
+        return json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"Failed to read search cache: {e}")
+        return None
+
+
+async def put(query: str, type: str, limit: int, market: str | None, data: dict):
+    key = _key(query, type, limit, market)
+    try:
+        async with r.pipeline(transaction=False) as pipe:
+            pipe.set(key, json.dumps(data), ex=SEARCH_CACHE_TTL)
+            pipe.zadd(_LRU_KEY, {key: time.time()})
+            pipe.zcard(_LRU_KEY)
+            *_, size = await pipe.execute()
+        overflow = size - SEARCH_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            evicted = [member for member, _ in await r.zpopmin(_LRU_KEY, overflow)]
+            if evicted:
+                await r.delete(*evicted)
+    except Exception as e:
+        print(f"Failed to write search cache: {e}")
+
+
+async def stats() -> dict:
+    counters = await r.hgetall(_STATS_KEY)
+    hits = int(counters.get(b"hits") or 0)
+    misses = int(counters.get(b"misses") or 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        "entries": await r.zcard(_LRU_KEY),
+    }
@@ -0,0 +1,317 @@
+from backend.redis_client import r
+from redis.exceptions import WatchError
+import orjson
+import os
+import re
+import secrets
+
+# Chat session state in Redis, laid out so proposal edits only touch what changed:
+#   session:{id}          hash   flags, the pending playlist's name/description, the
+#                                rolling summary of conversation folded out of history
+#                                and the owner's user ID, checked on every turn
+#   session:{id}:tracks   list   entry keys in playlist order
+#   session:{id}:entries  hash   entry key -> {"id": track_id | null, "display": {...}}
+#   session:{id}:index    hash   name token -> space separated entry keys
+#   session:{id}:history  list   conversation messages, {"role", "text"}, oldest first
+# A turn costs two round trips: load() reads all four keys in one pipeline, edits
+# are applied in memory and queued, and save() flushes the queue in one MULTI.
+# In memory the state keeps the shape the chat flow and frontend use, plus the
+# entry list, token index and queued writes.
+SESSION_TTL = 3600
+# Messages kept in the hot copy of the conversation; Supabase holds the full record.
+SESSION_HISTORY_MAX = int(os.getenv("SESSION_HISTORY_MAX", "200"))
+
+
+def _dumps(value) -> bytes:
+    return orjson.dumps(value)
+
+
+def _loads(raw):
+    return orjson.loads(raw)
+
+
+def _keys(session_id: str) -> tuple[str, str, str, str]:
+    base = f"session:{session_id}"
+    return base, f"{base}:tracks", f"{base}:entries", f"{base}:index"
+
+
+def _history_key(session_id: str) -> str:
+    return f"session:{session_id}:history"
+
+
+def _tokens(name: str | None) -> set[str]:
+    return set(re.findall(r"\w+", (name or "").lower()))
+
+
+def new_state(logged_in: bool, session_id: str | None = None) -> dict:
+    return {
+        "session_id": session_id,
+        "awaiting_confirmation": False,
+        "pending_playlist": None,
+        "logged_in": logged_in,
+        "entries": [],
+        "index": {},
+        "history": [],
+        "history_cached": False,
+        "summary": "",
+        "owner": None,
+        "writes": [],
+    }
+
+
+def _refresh_view(state: dict):
+    """Rebuild track_ids / tracks_display from the entry list."""
+    proposal = state.get("pending_playlist")
+    if proposal is not None:
+        proposal["track_ids"] = [entry["id"] for entry in state["entries"] if entry["id"]]
+        proposal["tracks_display"] = [entry["display"] for entry in state["entries"]]
+
+
+def _make_entries(items: list[tuple[str | None, dict]]) -> list[dict]:
+    return [{"key": secrets.token_hex(4), "id": track_id, "display": display} for track_id, display in items]
+
+
+def items_from_proposal(proposal: dict) -> list[tuple[str | None, dict]]:
+    """(track_id, display) pairs from a proposal in the frontend's shape.
+
+    Tracks that were not found have a display entry but no track ID (and no URL).
+    """
+    track_ids = iter(proposal.get("track_ids") or [])
+    items = [
+        (next(track_ids, None) if display.get("url") else None, display)
+        for display in proposal.get("tracks_display") or []
+    ]
+    items.extend((track_id, {"name": track_id, "artists": "", "url": "", "image": ""}) for track_id in track_ids)
+    return items
+
+
+def _flags(state: dict) -> dict:
+    return {
+        "awaiting_confirmation": int(bool(state.get("awaiting_confirmation"))),
+        "logged_in": int(bool(state.get("logged_in"))),
+    }
+
+
+def _queue(state: dict, command: str, *args, **kwargs):
+    state["writes"].append((command, args, kwargs))
+
+
+def _update_index(state: dict, tokens: set[str]):
+    """Recompute the index entries for `tokens` from the current entry list."""
+    postings: dict[str, list[str]] = {token: [] for token in tokens}
+    for entry in state["entries"]:
+        for token in _tokens(entry["display"].get("name")) & tokens:
+            postings[token].append(entry["key"])
+    live = {token: keys for token, keys in postings.items() if keys}
+    dead = [token for token, keys in postings.items() if not keys]
+    state["index"].update(live)
+    for token in dead:
+        state["index"].pop(token, None)
+
+    index_key = _keys(state["session_id"] or "")[3]
+    if live:
+        _queue(state, "hset", index_key, mapping={token: " ".join(keys) for token, keys in live.items()})
+    if dead:
+        _queue(state, "hdel", index_key, *dead)
+
+
+def _add_entries(state: dict, new_entries: list[dict]):
+    if not new_entries:
+        return
+    _, order_key, entries_key, _ = _keys(state["session_id"] or "")
+    state["entries"].extend(new_entries)
+    _queue(state, "rpush", order_key, *(entry["key"] for entry in new_entries))
+    _queue(state, "hset", entries_key, mapping={
+        entry["key"]: _dumps({"id": entry["id"], "display": entry["display"]})
+        for entry in new_entries
+    })
+    _update_index(state, set().union(*(_tokens(entry["display"].get("name")) for entry in new_entries)))
+
+
+async def load(session_id: str) -> dict:
+    """Read the whole session in one round trip."""
+    meta_key, order_key, entries_key, index_key = _keys(session_id)
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hgetall(meta_key)
+        pipe.lrange(order_key, 0, -1)
+        pipe.hgetall(entries_key)
+        pipe.hgetall(index_key)
+        pipe.lrange(_history_key(session_id), 0, -1)
+        meta, order, stored, index, history = await pipe.execute()
+
+    state = new_state(logged_in=True, session_id=session_id)
+    if not meta:
+        return state
+    meta = {key.decode(): value.decode() for key, value in meta.items()}
+    state["awaiting_confirmation"] = meta.get("awaiting_confirmation") == "1"
+    state["logged_in"] = meta.get("logged_in", "1") == "1"
+    # Sessions saved before history lived here have no hot copy; the caller seeds one
+    if meta.get("history") == "1":
+        state["history"] = [_loads(raw) for raw in history]
+        state["history_cached"] = True
+        state["summary"] = meta.get("summary") or ""
+        state["owner"] = meta.get("owner")
+    if meta.get("pending") == "1":
+        for key in order:
+            raw = stored.get(key)
+            if raw:
+                item = _loads(raw)
+                state["entries"].append({"key": key.decode(), "id": item.get("id"), "display": item.get("display") or {}})
+        state["index"] = {token.decode(): keys.decode().split() for token, keys in index.items()}
+        state["pending_playlist"] = {"name": meta.get("name"), "description": meta.get("description")}
+        if meta.get("playlist_id"):
+            state["pending_playlist"]["playlist_id"] = meta["playlist_id"]
+        _refresh_view(state)
+    return state
+
+
+async def save(state: dict):
+    """Flush every write queued during this turn in one MULTI round trip."""
+    writes, state["writes"] = state["writes"], []
+    if not state["session_id"]:
+        return
+    keys = _keys(state["session_id"])
+    meta_key = keys[0]
+    async with r.pipeline() as pipe:
+        for command, args, kwargs in writes:
+            getattr(pipe, command)(*args, **kwargs)
+        pipe.hset(meta_key, mapping=_flags(state))
+        for key in (*keys, _history_key(state["session_id"])):
+            pipe.expire(key, SESSION_TTL)
+        await pipe.execute()
+
+
+def proposal_matches(state: dict, name: str, description: str | None, items: list[tuple[str | None, dict]]) -> bool:
+    """Whether the pending proposal already holds exactly `name`, `description` and `items`."""
+    proposal = state.get("pending_playlist")
+    if proposal is None:
+        return False
+    return (
+        proposal.get("name") == name
+        and (proposal.get("description") or "") == (description or "")
+        and [(entry["id"], entry["display"]) for entry in state["entries"]] == list(items)
+    )
+
+
+def replace_proposal(
+    state: dict,
+    name: str,
+    description: str | None,
+    items: list[tuple[str | None, dict]],
+    playlist_id: str | None = None,
+):
+    """Set the pending proposal. `playlist_id` is set when the playlist already exists
+    and the items are tracks that still have to be added to it."""
+    meta_key, order_key, entries_key, index_key = _keys(state["session_id"] or "")
+    state["entries"] = []
+    state["index"] = {}
+    state["pending_playlist"] = {"name": name, "description": description}
+    if playlist_id:
+        state["pending_playlist"]["playlist_id"] = playlist_id
+    _queue(state, "delete", order_key, entries_key, index_key)
+    _queue(state, "hset", meta_key, mapping={
+        "pending": 1, "name": name, "description": description or "", "playlist_id": playlist_id or "",
+    })
+    _add_entries(state, _make_entries(items))
+    _refresh_view(state)
+
+
+def append_tracks(state: dict, items: list[tuple[str | None, dict]]) -> int:
+    new_entries = _make_entries(items)
+    _add_entries(state, new_entries)
+    _refresh_view(state)
+    return len(new_entries)
+
+
+def remove_tracks_by_name(state: dict, names: list[str]) -> int:
+    """Remove every track whose name contains one of `names` (whole words, case-insensitive).
+
+    Candidates come from the token index, so only tracks sharing all of a name's
+    words are compared instead of every track against every name.
+    """
+    by_key = {entry["key"]: entry for entry in state["entries"]}
+    removed: set[str] = set()
+    for name in (name.lower() for name in names if name):
+        tokens = _tokens(name)
+        if not tokens:
+            continue
+        candidates = set.intersection(*(set(state["index"].get(token, ())) for token in tokens))
+        for key in candidates:
+            entry = by_key.get(key)
+            if entry and name in (entry["display"].get("name") or "").lower():
+                removed.add(key)
+    if not removed:
+        return 0
+
+    _, order_key, entries_key, _ = _keys(state["session_id"] or "")
+    gone_tokens = set().union(*(_tokens(by_key[key]["display"].get("name")) for key in removed))
+    state["entries"] = [entry for entry in state["entries"] if entry["key"] not in removed]
+    for key in removed:
+        _queue(state, "lrem", order_key, 1, key)
+    _queue(state, "hdel", entries_key, *removed)
+    _update_index(state, gone_tokens)
+    _refresh_view(state)
+    return len(removed)
+
+
+def clear_proposal(state: dict):
+    meta_key, order_key, entries_key, index_key = _keys(state["session_id"] or "")
+    state["entries"] = []
+    state["index"] = {}
+    state["pending_playlist"] = None
+    state["awaiting_confirmation"] = False
+    _queue(state, "delete", order_key, entries_key, index_key)
+    _queue(state, "hdel", meta_key, "name", "description", "playlist_id")
+    _queue(state, "hset", meta_key, mapping={"pending": 0})
+
+
+def seed_history(state: dict, messages: list[dict], owner: str):
+    """Replace the hot copy of the conversation with the record from Supabase.
+
+    `owner` is the user the caller verified owns the session; later turns are checked against it.
+    """
+    history_key = _history_key(state["session_id"] or "")
+    state["history"] = messages[-SESSION_HISTORY_MAX:]
+    state["history_cached"] = True
+    state["summary"] = ""
+    state["owner"] = owner
+    _queue(state, "delete", history_key)
+    if state["history"]:
+        _queue(state, "rpush", history_key, *(_dumps(message) for message in state["history"]))
+    _queue(state, "hset", _keys(state["session_id"] or "")[0], mapping={"history": 1, "summary": "", "owner": owner})
+
+
+def append_history(state: dict, role: str, text: str):
+    history_key = _history_key(state["session_id"] or "")
+    message = {"role": role, "text": text}
+    state["history"].append(message)
+    del state["history"][:-SESSION_HISTORY_MAX]
+    _queue(state, "rpush", history_key, _dumps(message))
+    _queue(state, "ltrim", history_key, -SESSION_HISTORY_MAX, -1)
+
+
+async def fold_history(session_id: str, folded: list[dict], previous_summary: str, summary: str) -> bool:
+    """Replace the first len(folded) history messages with `summary`.
+
+    Runs after the turn that triggered it, so the session may have moved on: the
+    write only happens if the history still starts with `folded` and the summary is
+    still `previous_summary`. Messages appended meanwhile are kept.
+    """
+    meta_key, history_key = _keys(session_id)[0], _history_key(session_id)
+    for _ in range(3):
+        try:
+            async with r.pipeline() as pipe:
+                await pipe.watch(meta_key, history_key)
+                head = await pipe.lrange(history_key, 0, len(folded) - 1)
+                current = await pipe.hget(meta_key, "summary")
+                if [_loads(raw) for raw in head] != folded or (current or b"").decode() != previous_summary:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.hset(meta_key, "summary", summary)
+                pipe.ltrim(history_key, len(folded), -1)
+                await pipe.execute()
+                return True
+        except WatchError:
+            continue
+    return False
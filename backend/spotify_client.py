@@ -0,0 +1,209 @@
+import asyncio
+import httpx
+import importlib.util
+import os
+
+# Connection settings for the shared Spotify client. Every call to
+# api.spotify.com / accounts.spotify.com goes through one pooled, non-blocking
+# client so TCP+TLS handshakes are paid once per connection, not once per
+# request, and slow upstream responses never tie up a worker thread.
+SPOTIFY_HTTP_CONNECT_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_CONNECT_TIMEOUT", "5"))
+SPOTIFY_HTTP_READ_TIMEOUT = float(os.getenv("SPOTIFY_HTTP_READ_TIMEOUT", "10"))
+SPOTIFY_HTTP_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_HTTP_MAX_CONNECTIONS", "100"))
+SPOTIFY_HTTP_MAX_KEEPALIVE = int(os.getenv("SPOTIFY_HTTP_MAX_KEEPALIVE", "20"))
+SPOTIFY_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("SPOTIFY_HTTP_KEEPALIVE_EXPIRY", "30"))
+# Upper bound on concurrent upstream calls a single fan-out may start.
+SPOTIFY_FANOUT_CONCURRENCY = int(os.getenv("SPOTIFY_FANOUT_CONCURRENCY", "8"))
+# How long a BatchLoader waits for more IDs before sending a batch.
+SPOTIFY_BATCH_WINDOW = float(os.getenv("SPOTIFY_BATCH_WINDOW_MS", "5")) / 1000
+
+# HTTP/2 needs the optional `h2` package; fall back to keep-alive HTTP/1.1 without it.
+SPOTIFY_HTTP2 = (
+    os.getenv("SPOTIFY_HTTP2", "true").lower() != "false"
+    and importlib.util.find_spec("h2") is not None
+)
+
+_client: httpx.AsyncClient | None = None
+
+
+class SpotifyHTTPError(Exception):
+    """Raised when Spotify answers with a 4xx/5xx status."""
+
+    def __init__(self, code: int, reason: str, body: str = "", retry_after: float | None = None):
+        super().__init__(f"HTTP Error {code}: {reason}")
+        self.code = code
+        self.reason = reason
+        self.body = body
+        # Seconds from the Retry-After header (sent with 429 and some 503s), if any
+        self.retry_after = retry_after
+
+
+def _build_timeout(read_timeout: float | None = None) -> httpx.Timeout:
+    return httpx.Timeout(
+        read_timeout or SPOTIFY_HTTP_READ_TIMEOUT,
+        connect=SPOTIFY_HTTP_CONNECT_TIMEOUT,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=SPOTIFY_HTTP2,
+            timeout=_build_timeout(),
+            limits=httpx.Limits(
+                max_connections=SPOTIFY_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=SPOTIFY_HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=SPOTIFY_HTTP_KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def request(
+    method: str,
+    url: str,
+    headers: dict | None = None,
+    json=None,
+    data: dict | None = None,
+    content: bytes | None = None,
+    timeout: float | None = None,
+) -> httpx.Response:
+    """Send a request over the shared pool, raising SpotifyHTTPError on error statuses."""
+    resp = await get_client().request(
+        method,
+        url,
+        headers=headers,
+        json=json,
+        data=data,
+        content=content,
+        timeout=_build_timeout(timeout),
+    )
+    if resp.status_code >= 400:
+        try:
+            retry_after = float(resp.headers["Retry-After"])
+        except (KeyError, ValueError):
+            retry_after = None
+        raise SpotifyHTTPError(resp.status_code, resp.reason_phrase, resp.text, retry_after)
+    return resp
+
+
+async def request_json(
+    method: str,
+    url: str,
+    headers: dict | None = None,
+    json=None,
+    data: dict | None = None,
+    content: bytes | None = None,
+    timeout: float | None = None,
+):
+    """Like request(), but decode the JSON body. Empty bodies (e.g. 204) return None."""
+    resp = await request(method, url, headers=headers, json=json, data=data, content=content, timeout=timeout)
+    if not resp.content:
+        return None
+    return resp.json()
+
+
+async def gather_limited(*aws, limit: int | None = None, return_exceptions: bool = False) -> list:
+    """asyncio.gather, but with at most `limit` awaitables running at once. Results keep input order."""
+    semaphore = asyncio.Semaphore(limit or SPOTIFY_FANOUT_CONCURRENCY)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
+
+
+class BatchLoader:
+    """Coalesce ID lookups from concurrent callers into batched upstream calls.
+
+    IDs requested within `window` seconds of each other, from any request in this
+    process, are sent together in batches of at most `max_batch_size`. Each caller
+    gets back only the IDs it asked for. An ID already queued or in flight is
+    shared, never requested twice.
+
+    `batch_fn` takes a list of IDs and returns a dict of ID -> value. IDs it
+    leaves out resolve to None.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 100, window: float = SPOTIFY_BATCH_WINDOW):
+        self._batch_fn = batch_fn
+        self._max_batch_size = max_batch_size
+        self._window = window
+        self._queue: dict[str, asyncio.Future] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load_many(self, keys: list[str]) -> dict:
+        """Return ID -> value for every requested ID the batch function found."""
+        loop = asyncio.get_running_loop()
+        futures: dict[str, asyncio.Future] = {}
+        for key in dict.fromkeys(keys):
+            if not key:
+                continue
+            future = self._queue.get(key) or self._inflight.get(key)
+            if future is None:
+                future = loop.create_future()
+                # Mark errors as retrieved even if every waiter was cancelled.
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                self._queue[key] = future
+                if len(self._queue) >= self._max_batch_size:
+                    self._flush()
+            futures[key] = future
+
+        if self._queue and self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+
+        # Futures are shared with other callers, so shield them from our own cancellation.
+        values = await asyncio.gather(
+            *(asyncio.shield(future) for future in futures.values()),
+            return_exceptions=True,
+        )
+        results = {}
+        for key, value in zip(futures, values):
+            if isinstance(value, BaseException):
+                raise value
+            if value is not None:
+                results[key] = value
+        return results
+
+    async def load(self, key: str):
+        return (await self.load_many([key])).get(key)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, {}
+        keys = list(batch)
+        for start in range(0, len(keys), self._max_batch_size):
+            chunk = {key: batch[key] for key in keys[start:start + self._max_batch_size]}
+            self._inflight.update(chunk)
+            task = asyncio.get_running_loop().create_task(self._run(chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: dict[str, asyncio.Future]):
+        try:
+            results = await self._batch_fn(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(results.get(key))
+        finally:
+            for key in batch:
+                self._inflight.pop(key, None)
@@ -0,0 +1,184 @@
+from fastapi.concurrency import run_in_threadpool
+from pathlib import Path
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+# Every track the proposal flow resolves through Spotify search is indexed here by
+# its normalized title and artists, so later queries for the same song in another
+# form ("weeknd - blinding lights", "Blinding Lights by The Weeknd") resolve
+# locally. Kept in a SQLite file shared by every worker on the host; trigrams make
+# candidate lookup tolerant of word order, separators and small typos.
+TRACK_INDEX_DB_PATH = Path(
+    os.getenv("TRACK_INDEX_DB_PATH")
+    or Path(__file__).resolve().parent / ".cache" / "track_index.sqlite3"
+)
+# Minimum trigram similarity (Dice) between query and track for a local match.
+TRACK_INDEX_MIN_SIMILARITY = float(os.getenv("TRACK_INDEX_MIN_SIMILARITY", "0.85"))
+# Share of the artist name that must appear in the query; a bare title is ambiguous.
+TRACK_INDEX_MIN_ARTIST_COVERAGE = 0.6
+_CANDIDATES = 20
+
+_STOPWORDS = {"by", "the", "feat", "ft", "featuring", "and", "with"}
+# Suffixes Spotify appends to titles: "Song - Remastered 2011", "Song (Live)", "Song (feat. X)"
+_TITLE_SUFFIX = re.compile(r"\s+-\s+.*$|\(.*?\)|\[.*?\]")
+# Suffixes made only of these words (or years) are the same recording and are dropped
+_SAME_RECORDING_WORDS = {"remaster", "remastered", "digital", "digitally", "deluxe", "bonus", "track", "explicit"}
+_FEATURE_WORDS = {"feat", "ft", "featuring", "with"}
+# Words that mark a different recording; a match must agree with the query on them
+_VERSION_WORDS = {
+    "remix", "rmx", "mix", "edit", "version", "live", "acoustic", "unplugged", "instrumental",
+    "demo", "karaoke", "cover", "orchestral", "piano", "slowed", "sped", "reverb", "nightcore",
+    "acapella", "cappella", "rework", "extended", "dub", "session", "sessions", "stripped",
+}
+_SCHEMA_VERSION = 2
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+_disabled = False
+
+
+def _connect() -> sqlite3.Connection | None:
+    global _conn, _disabled
+    if _conn is not None or _disabled:
+        return _conn
+    try:
+        TRACK_INDEX_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(TRACK_INDEX_DB_PATH, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            # Older files indexed remixes/live versions under the original title; start over
+            conn.execute("DROP TABLE IF EXISTS tracks")
+            conn.execute("DROP TABLE IF EXISTS trigrams")
+            conn.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "track_id TEXT PRIMARY KEY, tokens TEXT NOT NULL, artist_tokens TEXT NOT NULL, "
+            "version_tokens TEXT NOT NULL, display TEXT NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS trigrams ("
+            "gram TEXT NOT NULL, track_id TEXT NOT NULL, PRIMARY KEY (gram, track_id)) WITHOUT ROWID"
+        )
+        _conn = conn
+    except Exception as e:
+        # Without the file every lookup is a miss and the flow falls back to search.
+        print(f"Track index unavailable: {e}")
+        _disabled = True
+    return _conn
+
+
+def _tokens(text: str) -> list[str]:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return [token for token in re.findall(r"\w+", stripped) if token not in _STOPWORDS]
+
+
+def _title_tokens(title: str) -> tuple[list[str], set[str]]:
+    """Tokens to index a title under, and the version words it carries.
+
+    Suffixes that only mark a remaster or a featured artist are dropped. Any other
+    suffix ("- Remix", "(Live)", or a title that simply contains " - ") stays part
+    of the title.
+    """
+    kept = []
+    for match in _TITLE_SUFFIX.finditer(title):
+        words = re.findall(r"\w+", match.group(0).lower())
+        if words and words[0] in _FEATURE_WORDS:
+            continue
+        if all(word.isdigit() or word in _SAME_RECORDING_WORDS for word in words):
+            continue
+        kept.append(match.group(0))
+    tokens = _tokens(_TITLE_SUFFIX.sub(" ", title)) + _tokens(" ".join(kept))
+    return tokens or _tokens(title), set(tokens) & _VERSION_WORDS
+
+
+def _token_key(tokens: list[str]) -> str:
+    """Order-independent form: sorted unique tokens."""
+    return " ".join(sorted(set(tokens)))
+
+
+def _trigrams(token_key: str) -> set[str]:
+    padded = f"  {token_key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a: set[str], b: set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b)) if a and b else 0.0
+
+
+def find(query: str) -> dict | None:
+    """Best indexed track for `query` if it is a confident match, else None."""
+    query_tokens = set(_tokens(query))
+    query_key = _token_key(list(query_tokens))
+    if not query_key:
+        return None
+    query_grams = _trigrams(query_key)
+    query_versions = query_tokens & _VERSION_WORDS
+
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return None
+        grams = list(query_grams)
+        placeholders = ",".join("?" * len(grams))
+        rows = conn.execute(
+            f"SELECT t.track_id, t.tokens, t.artist_tokens, t.version_tokens, t.display FROM tracks t "
+            f"JOIN (SELECT track_id, COUNT(*) AS shared FROM trigrams WHERE gram IN ({placeholders}) "
+            f"GROUP BY track_id ORDER BY shared DESC LIMIT {_CANDIDATES}) c ON c.track_id = t.track_id",
+            grams,
+        ).fetchall()
+
+    best, best_score = None, 0.0
+    for track_id, tokens, artist_tokens, version_tokens, display in rows:
+        # A plain query never takes a remix/live/acoustic version, and a versioned query never takes the original
+        if set(version_tokens.split()) != query_versions:
+            continue
+        score = _dice(query_grams, _trigrams(tokens))
+        artist_grams = _trigrams(artist_tokens)
+        coverage = len(artist_grams & query_grams) / len(artist_grams) if artist_grams else 0.0
+        if score >= TRACK_INDEX_MIN_SIMILARITY and coverage >= TRACK_INDEX_MIN_ARTIST_COVERAGE and score > best_score:
+            best, best_score = {"id": track_id, "display": json.loads(display)}, score
+    return best
+
+
+def insert(track_id: str, title: str, artists: list[str], display: dict):
+    title_tokens, versions = _title_tokens(title)
+    # Queries name the lead artist, rarely the features
+    artist_tokens = _tokens(artists[0]) if artists else []
+    tokens = _token_key(title_tokens + artist_tokens)
+    if not track_id or not tokens:
+        return
+    with _lock:
+        conn = _connect()
+        if conn is None:
+            return
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO tracks (track_id, tokens, artist_tokens, version_tokens, display) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (track_id, tokens, _token_key(artist_tokens), _token_key(list(versions)), json.dumps(display)),
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO trigrams (gram, track_id) VALUES (?, ?)",
+                [(gram, track_id) for gram in _trigrams(tokens)],
+            )
+
+
+async def lookup(query: str) -> dict | None:
+    try:
+        return await run_in_threadpool(find, query)
+    except Exception as e:
+        print(f"Failed to read track index: {e}")
+        return None
+
+
+async def remember(track_id: str, title: str, artists: list[str], display: dict):
+    try:
+        await run_in_threadpool(insert, track_id, title, artists, display)
+    except Exception as e:
+        print(f"Failed to write track index: {e}")
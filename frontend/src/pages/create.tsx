@@ -1,4 +1,4 @@
-import { useState, useRef, useEffect } from "react";
+import { useState, useRef, useEffect, useLayoutEffect } from "react";
 import {
   Button,
   Textarea,
@@ -25,7 +25,7 @@ import { Send, Sparkles, Bot, User, Music, Disc3, History, Plus, Trash2, Search
 import ReactMarkdown from "react-markdown";
 import { useNavigate, useParams, Link } from "react-router-dom";
 
-import { api, Message } from "../services/api";
+import { api, Message, StoredMessage } from "../services/api";
 import { useAuth } from "@/hooks/useAuth";
 
 // Backend expects this structure for history
@@ -46,10 +46,16 @@ export default function CreateWithAIPage() {
   const [input, setInput] = useState("");
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const chatScrollRef = useRef<HTMLDivElement>(null);
+  // Distance from the bottom of the chat to restore after prepending earlier messages
+  const preservedScrollRef = useRef<number | null>(null);
 
   // Session State
   const { user, isAuthenticated, isLoading: isAuthLoading } = useAuth();
   const [sessions, setSessions] = useState<Session[]>([]);
+  // Cursor for the next page of older chats; null once every chat is loaded
+  const [sessionsCursor, setSessionsCursor] = useState<string | null>(null);
+  const [isLoadingMoreSessions, setIsLoadingMoreSessions] = useState(false);
   const [currentSessionId, setCurrentSessionId] = useState<string | null>(null);
   const { isOpen, onOpen, onOpenChange } = useDisclosure();
   const { isOpen: isReviewOpen, onOpen: onReviewOpen, onOpenChange: onReviewOpenChange } = useDisclosure();
@@ -93,6 +99,9 @@ export default function CreateWithAIPage() {
   };
   
   const [messages, setMessages] = useState<Message[]>([WELCOME_MESSAGE]);
+  // Cursor for the page before the oldest loaded message; null once the start is reached
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [isLoadingEarlier, setIsLoadingEarlier] = useState(false);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -104,7 +113,7 @@ export default function CreateWithAIPage() {
       if (user) {
         // Only load sessions list if we haven't already or if it's the first time
         if (sessions.length === 0) {
-            await loadSessions(user.id);
+            await loadSessions();
         }
         
         if (sessionId) {
@@ -121,37 +130,45 @@ export default function CreateWithAIPage() {
     initialize();
   }, [user, sessionId]);
 
-  const loadSessions = async (userId: string) => {
+  const loadSessions = async () => {
       try {
-          const data = await api.gemini.getSessions(userId);
-          setSessions(data);
+          const data = await api.gemini.getSessions();
+          setSessions(data.sessions);
+          setSessionsCursor(data.nextCursor);
       } catch (e) {
           console.error("Failed to load sessions", e);
       }
   };
 
+  const loadMoreSessions = async () => {
+      if (!sessionsCursor) return;
+      setIsLoadingMoreSessions(true);
+      try {
+          const data = await api.gemini.getSessions({ before: sessionsCursor });
+          setSessions(prev => [...prev, ...data.sessions.filter(s => !prev.some(p => p.id === s.id))]);
+          setSessionsCursor(data.nextCursor);
+      } catch (e) {
+          console.error("Failed to load more sessions", e);
+      } finally {
+          setIsLoadingMoreSessions(false);
+      }
+  };
+
   const loadSessionData = async (sid: string) => {
       setIsLoading(true);
       try {
           const data = await api.gemini.getSessionMessages(sid);
           const msgs = data.messages;
           
-          const formattedMessages: Message[] = msgs.map((m, index) => {
-              const baseMsg: Message = {
-                  id: m.id,
-                  role: m.role === "model" ? "ai" : "user",
-                  content: m.content,
-                  type: "text"
-              };
-              
-              if (index === msgs.length - 1 && baseMsg.role === "ai") {
-                  baseMsg.isAwaitingConfirmation = data.is_awaiting_confirmation;
-                  baseMsg.pendingPlaylist = data.pending_playlist;
-              }
-              return baseMsg;
-          });
+          const formattedMessages: Message[] = formatStoredMessages(msgs);
+          const last = formattedMessages[formattedMessages.length - 1];
+          if (last && last.role === "ai") {
+              last.isAwaitingConfirmation = data.is_awaiting_confirmation;
+              last.pendingPlaylist = data.pending_playlist;
+          }
           
           setMessages([WELCOME_MESSAGE, ...formattedMessages]);
+          setOlderCursor(data.has_more ? data.older_cursor ?? null : null);
           setCurrentSessionId(sid);
       } catch (e) {
           console.error("Failed to load session messages", e);
@@ -161,7 +178,39 @@ export default function CreateWithAIPage() {
       }
   };
 
-  useEffect(() => {
+  const formatStoredMessages = (msgs: StoredMessage[]): Message[] =>
+      msgs.map((m) => ({
+          id: m.id,
+          role: m.role === "model" ? "ai" : "user",
+          content: m.content,
+          type: "text"
+      }));
+
+  const loadEarlierMessages = async () => {
+      if (!currentSessionId || !olderCursor) return;
+      setIsLoadingEarlier(true);
+      try {
+          const data = await api.gemini.getSessionMessages(currentSessionId, { before: olderCursor });
+          const earlier = formatStoredMessages(data.messages);
+          const container = chatScrollRef.current;
+          if (container) preservedScrollRef.current = container.scrollHeight - container.scrollTop;
+          setMessages(prev => [WELCOME_MESSAGE, ...earlier, ...prev.filter(msg => msg.id !== WELCOME_MESSAGE.id)]);
+          setOlderCursor(data.has_more ? data.older_cursor ?? null : null);
+      } catch (e) {
+          console.error("Failed to load earlier messages", e);
+      } finally {
+          setIsLoadingEarlier(false);
+      }
+  };
+
+  useLayoutEffect(() => {
+    // Prepending earlier messages keeps the reader's place instead of jumping to the bottom
+    const container = chatScrollRef.current;
+    if (preservedScrollRef.current !== null && container) {
+      container.scrollTop = container.scrollHeight - preservedScrollRef.current;
+      preservedScrollRef.current = null;
+      return;
+    }
     scrollToBottom();
   }, [messages, isLoading]);
 
@@ -181,6 +230,7 @@ export default function CreateWithAIPage() {
   const handleNewChat = (shouldNavigate = true) => {
       setCurrentSessionId(null);
       setMessages([WELCOME_MESSAGE]);
+      setOlderCursor(null);
       setInput("");
       if (shouldNavigate) {
           navigate("/create");
@@ -226,6 +276,14 @@ export default function CreateWithAIPage() {
     setIsLoading(true);
 
     let activeSessionId = currentSessionId;
+    // The reply is shown in this message while it streams in
+    const streamId = (Date.now() + 1).toString();
+    const showStreaming = (content: string) =>
+      setMessages((prev) =>
+        prev.some((msg) => msg.id === streamId)
+          ? prev.map((msg) => (msg.id === streamId ? { ...msg, content } : msg))
+          : [...prev, { id: streamId, role: "ai", content, type: "text" }],
+      );
 
     try {
       // 1.5 Create Session if needed
@@ -243,8 +301,8 @@ export default function CreateWithAIPage() {
           }
       }
 
-      // 2. Prepare History
-      const history = getHistoryForBackend(newMessages);
+      // 2. Prepare History (saved sessions keep theirs on the server)
+      const history = activeSessionId ? [] : getHistoryForBackend(newMessages);
 
       // Default the override payload to the newest message if the user simply types "Yes" via keyboard
       let finalPlaylistOverride = playlistOverride;
@@ -256,7 +314,20 @@ export default function CreateWithAIPage() {
       }
 
       // 3. Call the API
-      const data = await api.gemini.chat(userMsg.content, history, activeSessionId || undefined, finalPlaylistOverride);
+      let streamedText = "";
+      const data = await api.gemini.chatStream(userMsg.content, history, activeSessionId || undefined, finalPlaylistOverride, {
+        onText: (delta) => {
+          streamedText += delta;
+          showStreaming(streamedText);
+        },
+        onProgress: (progress) => {
+          if (progress.stage === "resolving_tracks") {
+            showStreaming(`Finding tracks on Spotify (${progress.resolved}/${progress.total})...`);
+          } else if (progress.stage === "creating_playlist") {
+            showStreaming("Creating your playlist...");
+          }
+        },
+      });
 
       // 4. Process AI Response
       const isPlaylistContext =
@@ -276,7 +347,7 @@ export default function CreateWithAIPage() {
           : undefined;
 
       const aiResponse: Message = {
-        id: (Date.now() + 1).toString(),
+        id: streamId,
         role: "ai",
         content: data.text,
         type: isPlaylistContext ? "playlist-preview" : "text",
@@ -285,7 +356,7 @@ export default function CreateWithAIPage() {
         pendingPlaylist: data.pending_playlist,
       };
 
-      setMessages((prev) => [...prev, aiResponse]);
+      setMessages((prev) => [...prev.filter((msg) => msg.id !== streamId), aiResponse]);
     } catch (error) {
       console.error("Chat failed", error);
       const errorMsg: Message = {
@@ -295,7 +366,7 @@ export default function CreateWithAIPage() {
           "Sorry, I'm having trouble connecting to the server right now.",
         type: "text",
       };
-      setMessages((prev) => [...prev, errorMsg]);
+      setMessages((prev) => [...prev.filter((msg) => msg.id !== streamId), errorMsg]);
     } finally {
       setIsLoading(false);
     }
@@ -365,8 +436,19 @@ export default function CreateWithAIPage() {
         </div>
 
         {/* Chat History */}
-        <ScrollShadow className="flex-1 rounded-2xl bg-zinc-900/30 border border-white/5 backdrop-blur-sm p-4 md:p-6 mb-4 overflow-y-auto">
+        <ScrollShadow ref={chatScrollRef} className="flex-1 rounded-2xl bg-zinc-900/30 border border-white/5 backdrop-blur-sm p-4 md:p-6 mb-4 overflow-y-auto">
           <div className="flex flex-col gap-6 min-h-0">
+            {olderCursor && (
+              <Button
+                  size="sm"
+                  variant="flat"
+                  className="self-center bg-zinc-800 text-zinc-300 border border-white/10"
+                  onPress={loadEarlierMessages}
+                  isLoading={isLoadingEarlier}
+              >
+                  Load earlier messages
+              </Button>
+            )}
             {messages.map((msg, index) => {
               const spotifyMatch = msg.content.match(/(?:View on Spotify:\s*)?(https:\/\/open\.spotify\.com\/playlist\/[a-zA-Z0-9]+)/i);
               const cleanText = spotifyMatch ? msg.content.replace(spotifyMatch[0], "").trim() : msg.content;
@@ -803,6 +885,17 @@ export default function CreateWithAIPage() {
                               </ListboxItem>
                           )}
                       </Listbox>
+                      {sessionsCursor && (
+                          <Button
+                              size="sm"
+                              variant="flat"
+                              className="w-full mt-2 bg-zinc-800 text-zinc-300 border border-white/10"
+                              onPress={loadMoreSessions}
+                              isLoading={isLoadingMoreSessions}
+                          >
+                              Load older chats
+                          </Button>
+                      )}
                   </ScrollShadow>
               </DrawerBody>
             </>
@@ -79,10 +79,15 @@ export default function PlaylistsPage() {
   // Fetch Playlists Function
   const fetchPlaylists = () => {
     setLoading(true);
-    api.spotify.getPlaylists()
-      .then((data) => {
-        if (!data) return;
-        setPlaylists(data.playlists || []);
+    const received: Playlist[] = [];
+    // Render playlists as each page streams in instead of waiting for the full list
+    api.spotify.streamPlaylists((playlist) => {
+      received.push(playlist);
+      setPlaylists([...received]);
+      setLoading(false);
+    })
+      .then(() => {
+        setPlaylists([...received]);
         setError(null);
       })
       .catch((err) => {
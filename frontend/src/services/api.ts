@@ -16,10 +16,29 @@ export interface BackendHistoryItem {
   parts: string[];
 }
 
+export interface StoredMessage {
+  id: string;
+  role: string;
+  content: string;
+  created_at: string;
+}
+
+export interface SessionMessagesPage {
+  messages: StoredMessage[];
+  is_awaiting_confirmation?: boolean;
+  pending_playlist?: any;
+  has_more?: boolean;
+  older_cursor?: string | null;
+  newer_cursor?: string | null;
+}
+
 export interface GeminiChatResponse {
   text: string;
   playlist_id?: string;
-  history: BackendHistoryItem[];
+  // The user message and reply from this call
+  turn: BackendHistoryItem[];
+  // Only returned for chats without a session
+  history?: BackendHistoryItem[];
   is_awaiting_confirmation?: boolean;
   pending_playlist?: any;
 }
@@ -32,9 +51,7 @@ export class AuthError extends Error {
   }
 }
 
-async function fetchJson<T>(url: string, options?: RequestInit): Promise<T> {
-  const response = await fetch(url, options);
-
+async function checkResponse(response: Response): Promise<void> {
   // Handle manual redirect (opaque or explicit 3xx) which implies Auth redirect in this app
   if (
     response.type === "opaqueredirect" ||
@@ -58,10 +75,79 @@ async function fetchJson<T>(url: string, options?: RequestInit): Promise<T> {
     }
     throw new Error(errorMessage);
   }
+}
 
+async function fetchJson<T>(url: string, options?: RequestInit): Promise<T> {
+  const response = await fetch(url, options);
+  await checkResponse(response);
   return response.json();
 }
 
+// Read an NDJSON response line by line, handing each parsed object to onItem as soon as it arrives.
+async function fetchNdjson<T>(url: string, onItem: (item: T) => void, options?: RequestInit): Promise<void> {
+  const response = await fetch(url, options);
+  await checkResponse(response);
+  if (!response.body) return;
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+
+  const emit = (line: string) => {
+    if (!line.trim()) return;
+    const item = JSON.parse(line);
+    if (item && item.error) throw new Error(item.error);
+    onItem(item);
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const lines = buffered.split("\n");
+    buffered = lines.pop() ?? "";
+    lines.forEach(emit);
+  }
+  emit(buffered + decoder.decode());
+}
+
+// Server-Sent Events over fetch (EventSource can't POST). Calls onEvent for each event.
+async function fetchSse(url: string, onEvent: (event: string, data: any) => void, options?: RequestInit): Promise<void> {
+  const response = await fetch(url, options);
+  await checkResponse(response);
+  if (!response.body) return;
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = "";
+
+  const emit = (block: string) => {
+    let event = "message";
+    const data: string[] = [];
+    block.split("\n").forEach((line) => {
+      if (line.startsWith("event:")) event = line.slice(6).trim();
+      else if (line.startsWith("data:")) data.push(line.slice(5).trimStart());
+    });
+    if (data.length) onEvent(event, JSON.parse(data.join("\n")));
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffered += decoder.decode(value, { stream: true });
+    const blocks = buffered.split("\n\n");
+    buffered = blocks.pop() ?? "";
+    blocks.forEach(emit);
+  }
+  emit(buffered + decoder.decode());
+}
+
+export interface ChatProgress {
+  stage: "resolving_tracks" | "creating_playlist" | "analyzing_taste";
+  resolved?: number;
+  total?: number;
+}
+
 export const api = {
   gemini: {
     createSession: (userId: string, title?: string) => 
@@ -71,26 +157,67 @@ export const api = {
         body: JSON.stringify({ user_id: userId, title }),
       }),
 
-    getSessions: (userId: string) => 
-      fetchJson<{ id: string; title: string; updated_at: string }[]>(`${BASE_URL}/gemini/sessions?user_id=${userId}`),
+    // Most recently updated first; nextCursor is the `before` value for the next page, null on the last one.
+    getSessions: async (options: { limit?: number; before?: string } = {}) => {
+      const params = new URLSearchParams();
+      if (options.limit) params.set("limit", String(options.limit));
+      if (options.before) params.set("before", options.before);
+      const query = params.toString();
+      const response = await fetch(`${BASE_URL}/gemini/sessions${query ? `?${query}` : ""}`);
+      await checkResponse(response);
+      const sessions: { id: string; title: string; updated_at: string }[] = await response.json();
+      return { sessions, nextCursor: response.headers.get("X-Next-Cursor") };
+    },
 
-    getSessionMessages: (sessionId: string) =>
-      fetchJson<{ messages: { id: string; role: string; content: string; created_at: string }[], is_awaiting_confirmation?: boolean, pending_playlist?: any }>(`${BASE_URL}/gemini/sessions/${sessionId}/messages`),
+    // Latest page by default; pass `before` (a page's older_cursor) for earlier messages.
+    getSessionMessages: (sessionId: string, options: { limit?: number; before?: string } = {}) => {
+      const params = new URLSearchParams();
+      if (options.limit) params.set("limit", String(options.limit));
+      if (options.before) params.set("before", options.before);
+      const query = params.toString();
+      return fetchJson<SessionMessagesPage>(`${BASE_URL}/gemini/sessions/${sessionId}/messages${query ? `?${query}` : ""}`);
+    },
 
     deleteSession: (sessionId: string) =>
       fetchJson(`${BASE_URL}/gemini/sessions/${sessionId}`, {
         method: "DELETE",
       }),
 
+    // With a sessionId the server keeps the conversation, so history can be left empty
     chat: (message: string, history: BackendHistoryItem[], sessionId?: string, pendingPlaylistOverride?: any) => 
       fetchJson<GeminiChatResponse>(`${BASE_URL}/gemini/chat`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message, history, session_id: sessionId, pending_playlist_override: pendingPlaylistOverride }),
       }),
+
+    // Same as chat, but reply text and tool progress arrive while the turn runs
+    chatStream: async (
+      message: string,
+      history: BackendHistoryItem[],
+      sessionId?: string,
+      pendingPlaylistOverride?: any,
+      handlers: { onText?: (delta: string) => void; onProgress?: (progress: ChatProgress) => void } = {},
+    ) => {
+      let result: GeminiChatResponse | undefined;
+      await fetchSse(`${BASE_URL}/gemini/chat/stream`, (event, data) => {
+        if (event === "text") handlers.onText?.(data.delta);
+        else if (event === "progress") handlers.onProgress?.(data);
+        else if (event === "done") result = data;
+        else if (event === "error") throw new Error(data.detail);
+      }, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ message, history, session_id: sessionId, pending_playlist_override: pendingPlaylistOverride }),
+      });
+      if (!result) throw new Error("Chat stream ended before the reply was complete");
+      return result;
+    },
   },
   spotify: {
     getPlaylists: () => fetchJson<{ playlists: any[] }>(`${BASE_URL}/spotify/playlists`, { redirect: "manual" }),
+    streamPlaylists: (onPlaylist: (playlist: any) => void) =>
+        fetchNdjson<any>(`${BASE_URL}/spotify/playlists?stream=true`, onPlaylist, { redirect: "manual" }),
     createPlaylist: (name: string, description?: string, publicPlaylist?: boolean) => {
         return fetchJson<any>(`${BASE_URL}/spotify/playlists`, {
             method: "POST",
@@ -106,7 +233,8 @@ export const api = {
             redirect: "manual"
         });
     },
-    getPlaylist: (id: string) => fetchJson<any>(`${BASE_URL}/spotify/playlists/${id}`),
+    getPlaylist: (id: string, allTracks = true) =>
+        fetchJson<any>(`${BASE_URL}/spotify/playlists/${id}${allTracks ? "?all_tracks=true" : ""}`),
     
     // time_range: "short_term" | "medium_term" | "long_term"
     // limit: default 20